@@ -0,0 +1,161 @@
+#!/usr/bin/python
+
+import os
+import gc
+import json
+import shutil
+import tempfile
+import datetime
+import subprocess
+
+import torch
+import transformers
+import peft
+
+from modules.launcher import launch
+from modules.settings import Settings
+from modules.data import DataProcessor
+from modules.model import Model
+from modules.benchmark import Stopwatch, measureGeneration
+from modules.device import resolveDevice
+
+
+outputOption = "--output="
+noTrainOption = "--no-train"
+
+promptLengths = [16, 128, 512]
+concurrencyLevels = [1, 4]
+requestsPerRun = 8
+generationLimit = 32
+
+
+def gitCommit():
+    try:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=directory, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Prompts are numbered, so they don't share a prefix (no prefix cache hits between requests).
+def makePrompts(tokenizer, length, count):
+    ids = tokenizer("The quick brown fox jumps over the lazy dog. ", add_special_tokens=False)["input_ids"]
+    ids = (ids * (length // len(ids) + 1))[:length]
+    text = tokenizer.decode(ids)
+    return [f"{i}. {text}" for i in range(count)]
+
+
+def benchmarkTraining(settings):
+    trset = settings.training
+    outputPath = tempfile.mkdtemp(prefix="benchmark-")
+    trset.outputPath = os.path.join(outputPath, "adapter")
+    trset.epochs = 1
+    trset.dataCache = False
+    trset.streaming = False
+
+    try:
+        dp = DataProcessor(settings.templatePath)
+        with Stopwatch() as loadData:
+            data = dp.loadData(trset.dataPath)
+
+        with Stopwatch() as loadModel:
+            model = Model(settings)
+        with Stopwatch() as prepareData:
+            data = model.prepareData(dp)
+        with Stopwatch() as train:
+            model.train(data)
+
+        tokens = sum(len(ids) for ids in data["input_ids"])
+        return {
+            "dataLoadSeconds" : loadData.seconds,
+            "dataPrepareSeconds" : prepareData.seconds,
+            "modelLoadSeconds" : loadModel.seconds,
+            "samples" : len(data),
+            "tokens" : tokens,
+            "seconds" : train.seconds,
+            "samplesPerSecond" : len(data) / train.seconds,
+            "tokensPerSecond" : tokens / train.seconds
+        }
+    finally:
+        shutil.rmtree(outputPath, ignore_errors=True)
+
+
+def benchmarkGeneration(settings):
+    # Runs repeat the same prompts, cached responses would be measured instead of generation.
+    settings.inference.responseCacheEntries = 0
+    with Stopwatch() as loadModel:
+        model = Model(settings, trainable=False)
+    tokenizer = model.tokenizer.tokenizer
+    inset = settings.inference
+
+    def generate(prompt):
+        return model.generate(prompt, limit=generationLimit, temp=inset.temperature, top_p=inset.top_p, top_k=inset.top_k)
+
+    def tokenCount():
+        return model.engine.tokenCount
+
+    # First forward passes include one-time setup costs. Also creates the engine.
+    model.warmup()
+
+    runs = []
+    context = getattr(model.model.config, "max_position_embeddings", None)
+    for length in promptLengths:
+        if context and length + generationLimit > context:
+            print(f"Skipping prompt length {length}, exceeds model context of {context} tokens.")
+            continue
+        prompts = makePrompts(tokenizer, length, requestsPerRun)
+        for concurrency in concurrencyLevels:
+            print(f"Generation: prompt length {length}, concurrency {concurrency}")
+            run = measureGeneration(generate, tokenCount, prompts, concurrency)
+            runs.append({ "promptLength" : length, **run })
+
+    return {
+        "modelLoadSeconds" : loadModel.seconds,
+        "limit" : generationLimit,
+        "runs" : runs
+    }
+
+
+# Usage: benchmark.py <settingFile> [--output=<file.json>] [--no-train]
+# Measures generation (always) and training (if settings contain training data). Results are JSON.
+def main(s : str = None, *options):
+    outputPath = None
+    train = True
+    for option in options:
+        if option.startswith(outputOption):
+            outputPath = option[len(outputOption):]
+        elif option == noTrainOption:
+            train = False
+
+    settings = Settings(s)
+    settings.print()
+
+    result = {
+        "settings" : s,
+        "time" : datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit" : gitCommit(),
+        "versions" : {
+            "torch" : torch.__version__,
+            "transformers" : transformers.__version__,
+            "peft" : peft.__version__
+        },
+        "device" : resolveDevice(settings.base.device)
+    }
+
+    # Training runs first, its model is released before the inference model is loaded.
+    if train and settings.training.dataPath and settings.adapter.loraModules:
+        result["training"] = benchmarkTraining(Settings(s))
+        gc.collect()
+    result["generation"] = benchmarkGeneration(settings)
+
+    output = json.dumps(result, indent=2)
+    if outputPath:
+        with open(outputPath, 'w') as file:
+            file.write(output)
+        print(f"Benchmark results written to {outputPath}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    launch(main)
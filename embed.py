@@ -1,45 +1,69 @@
 #!/usr/bin/python
 
 import os
+import csv
 
-from torch.nn.functional import cosine_similarity
+import numpy
 
 from modules.launcher import launch
 from modules.settings import Settings
 from modules.model import Model
 
 
-def embed(model, t):
-    emb = model.lookupEmbeddings(t)
-    if emb.shape[0] != 1:
-        print(f"Warning: Input {t} does not tokenize into single token.")
-    return emb[0]
+outputOption = "--output="
 
 
-def diff(model, a, b):
-    ea = embed(model, a)
-    eb = embed(model, b)
-    return cosine_similarity(ea, eb, dim=0)
+def writeMatrix(path, strings, matrix):
+    if path.endswith(".npy"):
+        numpy.save(path, matrix.cpu().numpy())
+    else:
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow([''] + list(strings))
+            for y, row in zip(strings, matrix.tolist()):
+                writer.writerow([y] + [f"{v:.6f}" for v in row])
 
 
-def main(s : str = None, *strings):
-    settings = Settings(s)
-    settings.print()
-
-    model = Model(settings, trainable=False)
-    print()
-    print(f"Cosine Similarity ({settings.ui.title})")
+def printMatrix(title, strings, matrix):
+    print(f"Cosine Similarity ({title})")
     print(f"{' ':8s}", end='')
     for x in strings:
         print(f"{x:>8s}", end='')
     print()
 
-    for y in strings:
+    for y, row in zip(strings, matrix.tolist()):
         print(f"{y:8s}", end='')
-        for x in strings:
-            print(f"{diff(model, x, y):8.3f}", end='')
+        for v in row:
+            print(f"{v:8.3f}", end='')
         print()
 
 
+# Usage: embed.py <settingFile> [--output=<file.csv|file.npy>] <token> ...
+def main(s : str = None, *strings):
+    outputPath = None
+    if strings and strings[0].startswith(outputOption):
+        outputPath = strings[0][len(outputOption):]
+        strings = strings[1:]
+
+    settings = Settings(s)
+    settings.print()
+
+    model = Model(settings, trainable=False)
+    embeddings, counts = model.lookupEmbeddingsBatch(list(strings))
+    for t, count in zip(strings, counts):
+        if count == 0:
+            print(f"Warning: Input {t!r} has no tokens, using a zero vector.")
+        elif count != 1:
+            print(f"Warning: Input {t} does not tokenize into single token.")
+
+    matrix = model.similarityMatrix(embeddings)
+    print()
+    if outputPath:
+        writeMatrix(outputPath, strings, matrix)
+        print(f"Similarity matrix written to {outputPath}")
+    else:
+        printMatrix(settings.ui.title, strings, matrix)
+
+
 if __name__ == "__main__":
     launch(main)
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+import json
+
+import numpy
+
+from modules.launcher import launch
+from modules.settings import Settings
+from modules.model import Model
+from modules.neighbors import nearestNeighbors
+
+
+outputOption = "--output="
+neighborsOption = "--neighbors="
+memoryOption = "--memory="
+
+
+# Usage: embedexport.py <settingFile> [--output=<prefix>] [--neighbors=<k>] [--memory=<MB>]
+# Writes the input embeddings of the whole vocabulary (adapter applied) to <prefix>.npy and their tokens
+# to <prefix>-tokens.json (list, index = row). With --neighbors, the k most similar tokens (cosine) of every
+# token go to <prefix>-neighbors.npy (int32 token ids) and <prefix>-scores.npy (float16 similarities),
+# computed in blocks within the memory budget (default 1024 MB). All .npy files can be memory mapped
+# (numpy.load(path, mmap_mode='r')).
+def main(s : str = None, *options):
+	settings = Settings(s)
+	prefix = settings.training.outputPath + "-embeddings"
+	k = None
+	memory = 1024
+	for option in options:
+		if option.startswith(outputOption):
+			prefix = option[len(outputOption):]
+		elif option.startswith(neighborsOption):
+			k = int(option[len(neighborsOption):])
+		elif option.startswith(memoryOption):
+			memory = int(option[len(memoryOption):])
+	settings.print()
+
+	model = Model(settings, trainable=False)
+	tokens = model.exportEmbeddings(prefix + ".npy")
+	with open(prefix + "-tokens.json", 'w') as file:
+		json.dump(tokens, file)
+	print(f"Embeddings of {len(tokens)} tokens written to {prefix}.npy")
+
+	if k:
+		embeddings = numpy.load(prefix + ".npy", mmap_mode='r')
+		ids = numpy.lib.format.open_memmap(prefix + "-neighbors.npy", mode="w+", dtype=numpy.int32, shape=(len(tokens), k))
+		scores = numpy.lib.format.open_memmap(prefix + "-scores.npy", mode="w+", dtype=numpy.float16, shape=(len(tokens), k))
+		nearestNeighbors(embeddings, ids, scores, memory * 1024 * 1024, device=model.device)
+		ids.flush()
+		scores.flush()
+		print(f"{k} nearest neighbors per token written to {prefix}-neighbors.npy and {prefix}-scores.npy")
+
+
+if __name__ == "__main__":
+    launch(main)
@@ -5,18 +5,40 @@ from modules.launcher import launch
 from modules.settings import Settings
 from modules.data import DataProcessor
 from modules.model import Model
+from modules.distributed import launchWorkers, mainProcessFirst, isMainProcess
 
 
-def main(s : str = None):
-	settings = Settings(s)
-	settings.print()
+nodeRankOption = "--node-rank="
 
+
+def train(settings : Settings):
 	model = Model(settings)
-	dp = DataProcessor(settings.templatePath)
-	data = dp.loadData(settings.training.dataPath)
-	print(f"Training data length: {len(data)}")
+	workers = settings.training.dataWorkers
+	dp = DataProcessor(settings.templatePath, numProc=workers if workers > 1 else None)
+	# Tokenized data is cached by the main process, the others load it from there.
+	with mainProcessFirst():
+		data = model.prepareData(dp)
+	if not settings.training.streaming and isMainProcess():
+		print(f"Training data length: {len(data)}")
 	model.train(data)
 
 
+# Usage: finetune.py <settingFile> [--node-rank=<rank>]
+# With a "distributed" section, worker processes train data parallel. On multiple nodes, each
+# node is started with its rank.
+def main(s : str = None, *options):
+	settings = Settings(s)
+	for option in options:
+		if option.startswith(nodeRankOption):
+			settings.distributed.nodeRank = int(option[len(nodeRankOption):])
+	settings.print()
+
+	ds = settings.distributed
+	if ds.processes * ds.nodes > 1:
+		launchWorkers(train, settings)
+	else:
+		train(settings)
+
+
 if __name__ == "__main__":
     launch(main)
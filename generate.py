@@ -1,20 +1,39 @@
 #!/usr/bin/python
 import os
 import re
-
-import gradio as gr
+import sys
+import json
+import signal
 
 from modules.launcher import launch
 from modules.settings import Settings
 from modules.template import Template
-from modules.model import Model
+from modules.daemon import InferenceServer, DaemonClient, socketPath
+from modules.batchfile import readRecords, completedIndices
+
+
+daemonOption = "--daemon"
+batchOption = "--batch="
+outputOption = "--output="
 
 
-def ui(model : Model, settings : Settings, template : Template):
-    def query(query : str, limit: int = 128, temp : float = 0.05, top_p: float = 0.9, top_k : int = 50):
+# Heavy imports (torch, transformers, gradio) happen on demand, so queries answered by a daemon stay fast.
+def loadModel(settings : Settings, warmup : bool = True):
+    from modules.model import Model
+    model = Model(settings, trainable=False)
+    if warmup:
+        model.warmup()
+    return model
+
+
+def ui(model, settings : Settings, template : Template):
+    import gradio as gr
+
+    # Runs on the event loop, a disconnected client cancels it and with it the generation.
+    async def query(query : str, limit: int = 128, temp : float = 0.05, top_p: float = 0.9, top_k : int = 50, adapter : str = None):
         full = ""
         request = template.apply(instruction=query, output="")
-        for r in model.generate(request, limit=limit, temp=temp, top_p=top_p, top_k=top_k):
+        async for r in model.generateAsync(request, limit=limit, temp=temp, top_p=top_p, top_k=top_k, adapter=adapter):
             print(r, end="")
             full += r
             yield full.strip()
@@ -30,29 +49,89 @@ def ui(model : Model, settings : Settings, template : Template):
             temp = gr.Slider(minimum=0, maximum=1, value=s.temperature, label="Temperature")
             top_p = gr.Slider(minimum=0, maximum=1, value=s.top_p, label="Top p")
             top_k = gr.Slider(minimum=0, maximum=(3 * s.top_k), step=1, value=s.top_k, label="Top k")
+            adapters = model.adapterNames()
+            adapter = gr.Dropdown(choices=adapters, value=(adapters[0] if adapters else None), label="Adapter", visible=(len(adapters) > 1))
 
-        input.submit(query, inputs=[input, limit, temp, top_p, top_k], outputs=output)
+        input.submit(query, inputs=[input, limit, temp, top_p, top_k, adapter], outputs=output, concurrency_limit=settings.inference.maxConcurrency)
 
     app.queue().launch()   
 
 
-def main(s : str = None, q : str = None):
+def serve(model, path : str, maxThreads : int):
+    # Exiting through SystemExit lets the server remove its socket.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    with InferenceServer(path, model, maxThreads=maxThreads) as server:
+        print(f"Serving on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+# Records are formatted with the configured input fields (ui.inputFields). Results are appended to
+# the output as { "index" : <record index>, "output" : ..., "record" : <input record> }. Records already
+# in the output are skipped, so an interrupted run continues where it stopped.
+def batch(settings : Settings, template : Template, inputPath : str, outputPath : str):
+    records = readRecords(inputPath)
+    done = completedIndices(outputPath)
+    pending = [i for i in range(len(records)) if i not in done]
+    print(f"{len(records)} records, {len(done)} already done.")
+    if not pending:
+        return
+
+    fields = settings.ui.inputFields.split(',')
+    inputs = [template.apply(**{ f : records[i].get(f, "") for f in fields }, output="") for i in pending]
+
+    inset = settings.inference
+    model = loadModel(settings, warmup=False)
+    results = model.generateBatch(inputs, batchSize=inset.maxBatchSize, limit=inset.maxLength // 2,
+                                  temp=inset.temperature, top_p=inset.top_p, top_k=inset.top_k)
+    with open(outputPath, 'a') as file:
+        for count, (i, output) in enumerate(results, start=1):
+            index = pending[i]
+            file.write(json.dumps({ "index" : index, "output" : output, "record" : records[index] }) + '\n')
+            file.flush()
+            if count % 100 == 0 or count == len(pending):
+                print(f"{len(done) + count} / {len(records)}")
+
+
+# Usage: generate.py <settingFile> [<query> | --daemon | --batch=<input.jsonl> [--output=<output.jsonl>]]
+# Queries are answered by a running daemon for the same settings file, if there is one.
+def main(s : str = None, q : str = None, *options):
     settings = Settings(s)
     settings.print()
 
-    model = Model(settings, trainable=False)
     templatePath = settings.inference.templatePath
     template = Template(templatePath)
-    
-    if q:
+    path = socketPath(s)
+
+    if q and q != daemonOption and not q.startswith(batchOption):
         request = template.apply(instruction=q, output="")
-        result = model.generate(request)
+        client = DaemonClient.connect(path)
+        if client:
+            result = client.generate(request)
+        else:
+            model = loadModel(settings, warmup=False)
+            result = model.generate(request)
         for r in result:
             print(r, end="", flush=True)
         print()
+        if not client and model.acceptanceRate() is not None:
+            print(f"Draft acceptance rate: {model.acceptanceRate():.1%}")
+
+    elif q and q.startswith(batchOption):
+        inputPath = q[len(batchOption):]
+        outputPath = os.path.splitext(inputPath)[0] + "-output.jsonl"
+        for option in options:
+            if option.startswith(outputOption):
+                outputPath = option[len(outputOption):]
+        batch(settings, template, inputPath, outputPath)
+
+    elif q == daemonOption:
+        serve(loadModel(settings), path, settings.inference.maxConcurrency)
 
     else:
-        ui(model, settings, template)
+        ui(loadModel(settings), settings, template)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,25 @@
+#!/usr/bin/python
+
+from modules.launcher import launch
+from modules.settings import Settings
+from modules.model import Model
+
+
+# Merging needs unquantized weights. The merged model can still be loaded with fewer bits.
+# Only the adapter of the settings file is merged, additional inference adapters are ignored.
+def main(s : str = None):
+	settings = Settings(s)
+	settings.base.bits = 16
+	settings.inference.adapters = None
+	settings.print()
+
+	model = Model(settings, trainable=False)
+	if model.merged:
+		print(f"Merged model is up to date: {model.mergedPath()}")
+	else:
+		path = model.mergeAdapter()
+		print(f"Merged model written to: {path}")
+
+
+if __name__ == "__main__":
+    launch(main)
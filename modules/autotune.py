@@ -0,0 +1,135 @@
+import re
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import torch
+
+
+# Step time, peak memory and memory in use before one training step. None if it ran out of memory
+# or wasn't run as it was estimated not to fit.
+Probe = Optional[Tuple[float, int, int]]
+
+
+# Largest micro batch size up to maxBatchSize that fits into memoryBudget, found by doubling and
+# then bisecting. probe(batchSize) runs a training step. Doubling also stops once the bigger batch
+# doesn't raise throughput by minGain, larger batches only cost probing time then.
+# Running out of memory on CPU is not an error that could be caught, so sizes are only probed if
+# their peak, extrapolated from the largest fitting probe, stays within the budget.
+# Returns the batch size with the best throughput and all probes, None if a single sample doesn't fit.
+def tuneBatchSize(probe : Callable[[int], Probe], maxBatchSize : int, memoryBudget : int = None,
+                  minGain : float = 0.05) -> Tuple[Optional[int], Dict[int, Probe]]:
+    probes = {}
+
+    def fits(batchSize):
+        if batchSize not in probes:
+            probes[batchSize] = probe(batchSize) if not memoryBudget or estimate(batchSize) <= memoryBudget else None
+        result = probes[batchSize]
+        return result is not None and (not memoryBudget or result[1] <= memoryBudget)
+
+    # Memory above what is in use before the step grows linearly with batch size.
+    def estimate(batchSize):
+        known = [b for b in probes if b < batchSize and fits(b)]
+        if not known:
+            return 0
+        _, peak, base = probes[max(known)]
+        return base + (peak - base) * batchSize / max(known)
+
+    def throughput(batchSize):
+        return batchSize / probes[batchSize][0]
+
+    if not fits(1):
+        return None, probes
+
+    low, high = 1, None
+    while low < maxBatchSize:
+        batchSize = min(low * 2, maxBatchSize)
+        if not fits(batchSize):
+            high = batchSize
+            break
+        improved = throughput(batchSize) >= throughput(low) * (1 + minGain)
+        low = batchSize
+        if not improved:
+            break
+
+    if high:
+        while high - low > 1:
+            middle = (low + high) // 2
+            if fits(middle):
+                low = middle
+            else:
+                high = middle
+
+    fitting = [b for b in probes if fits(b)]
+    return max(fitting, key=throughput), probes
+
+
+# Runs forward and backward pass on a batch of random tokens, the second of two runs is timed
+# (the first one includes allocations). Gradients are dropped afterwards.
+def probeTrainingStep(model, batchSize : int, length : int, device : str) -> Probe:
+    ids = torch.randint(0, model.config.vocab_size, (batchSize, length), device=device)
+    try:
+        for _ in range(2):
+            model.zero_grad(set_to_none=True)
+            baseMemory = _memoryInUse(device)
+            _resetPeakMemory(device)
+            start = time.perf_counter()
+            loss = model(input_ids=ids, attention_mask=torch.ones_like(ids), labels=ids).loss
+            loss.backward()
+            if device != "cpu":
+                torch.cuda.synchronize(device)
+            stepTime = time.perf_counter() - start
+        return stepTime, _peakMemory(device), baseMemory
+    except RuntimeError as e:
+        if "out of memory" not in str(e) and "can't allocate memory" not in str(e):
+            raise
+        return None
+    finally:
+        model.zero_grad(set_to_none=True)
+        if device != "cpu":
+            torch.cuda.empty_cache()
+
+
+# Share of device memory training may use. On CPU, memory in use plus an equal share of what the
+# system has available for each of the processes training on this machine.
+def memoryBudget(device : str, fraction : float, processes : int = 1) -> int:
+    if device != "cpu":
+        return int(torch.cuda.get_device_properties(device).total_memory * fraction)
+    available = _procValue("/proc/meminfo", "MemAvailable")
+    if available is None:
+        return None
+    return int((available / processes + _memoryInUse(device)) * fraction)
+
+
+# On CPU, the peak resident memory of the process. Resetting it needs Linux, elsewhere probes
+# report 0 and memory isn't limiting.
+def _resetPeakMemory(device : str):
+    if device != "cpu":
+        torch.cuda.reset_peak_memory_stats(device)
+        return
+    try:
+        with open("/proc/self/clear_refs", 'w') as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def _peakMemory(device : str) -> int:
+    if device != "cpu":
+        return torch.cuda.max_memory_allocated(device)
+    return _procValue("/proc/self/status", "VmHWM") or 0
+
+
+def _memoryInUse(device : str) -> int:
+    if device != "cpu":
+        return torch.cuda.memory_allocated(device)
+    return _procValue("/proc/self/status", "VmRSS") or 0
+
+
+# Sizes in /proc are given in kB.
+def _procValue(path : str, name : str) -> int:
+    try:
+        with open(path, 'r') as file:
+            match = re.search(rf'^{name}:\s+(\d+)', file.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return int(match.group(1)) * 1024 if match else None
@@ -0,0 +1,35 @@
+import os
+import json
+from typing import Dict, List, Set
+
+
+# Records of a .json file (list of objects) or .jsonl file (one object per line).
+def readRecords(path : str) -> List[Dict]:
+    with open(path, 'r') as file:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in file if line.strip()]
+        return json.load(file)
+
+
+# Indices of records already in the output file. An incomplete last line (interrupted write)
+# is cut off, so appending continues with a clean line.
+def completedIndices(outputPath : str) -> Set[int]:
+    if not os.path.exists(outputPath):
+        return set()
+
+    done = set()
+    valid = 0
+    with open(outputPath, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                done.add(json.loads(line)["index"])
+            except (ValueError, KeyError):
+                break
+            valid += len(line)
+
+    if valid != os.path.getsize(outputPath):
+        with open(outputPath, 'r+b') as file:
+            file.truncate(valid)
+    return done
@@ -0,0 +1,74 @@
+import time
+from threading import Thread
+from typing import Callable, Dict, Iterator, List
+
+
+class Stopwatch:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.seconds = None
+        return self
+
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.start
+
+
+def percentile(values : List[float], q : float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def latencySummary(values : List[float]) -> Dict[str, float]:
+    return {
+        "mean" : sum(values) / len(values) if values else None,
+        "p50" : percentile(values, 50),
+        "p99" : percentile(values, 99)
+    }
+
+
+# Runs prompts through generate with the given number of concurrent clients. tokenCount returns the
+# total of generated tokens so far, as generate() streams text. Text is streamed in words, so time to
+# first token is measured up to the first complete word.
+def measureGeneration(generate : Callable[[str], Iterator[str]], tokenCount : Callable[[], int],
+                      prompts : List[str], concurrency : int) -> Dict:
+    pending = list(reversed(prompts))
+    firstTokenTimes, latencies = [], []
+
+    def client():
+        while pending:
+            try:
+                prompt = pending.pop()
+            except IndexError:
+                return
+            start = time.perf_counter()
+            first = None
+            for _ in generate(prompt):
+                if first is None:
+                    first = time.perf_counter() - start
+            latencies.append(time.perf_counter() - start)
+            firstTokenTimes.append(first if first is not None else latencies[-1])
+
+    startCount = tokenCount()
+    with Stopwatch() as watch:
+        threads = [Thread(target=client) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    tokens = tokenCount() - startCount
+    return {
+        "concurrency" : concurrency,
+        "requests" : len(latencies),
+        "tokens" : tokens,
+        "seconds" : watch.seconds,
+        "tokensPerSecond" : tokens / watch.seconds,
+        "timeToFirstToken" : latencySummary(firstTokenTimes),
+        "latency" : latencySummary(latencies)
+    }
@@ -0,0 +1,63 @@
+import os
+import re
+import queue
+from threading import Thread
+from typing import Callable, List
+
+
+checkpointPattern = re.compile(r'checkpoint-(\d+)')
+
+
+# Finished checkpoints only, ordered by step. Checkpoints being written live in "tmp-checkpoint-<step>"
+# and are renamed when complete.
+def listCheckpoints(path : str) -> List[str]:
+    if not path or not os.path.isdir(path):
+        return []
+    steps = []
+    for name in os.listdir(path):
+        match = checkpointPattern.fullmatch(name)
+        if match and os.path.isdir(os.path.join(path, name)):
+            steps.append((int(match.group(1)), os.path.join(path, name)))
+    return [checkpoint for _, checkpoint in sorted(steps)]
+
+
+def latestCheckpoint(path : str) -> str:
+    checkpoints = listCheckpoints(path)
+    return checkpoints[-1] if checkpoints else None
+
+
+# Runs checkpoint writes on a background thread. At most one write waits while another
+# one is in progress, further submits block. Errors are raised on the next submit or wait.
+class CheckpointWriter:
+    def __init__(self):
+        self.jobs = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, job : Callable[[], None]):
+        self._raiseError()
+        self.jobs.put(job)
+
+
+    def wait(self):
+        self.jobs.join()
+        self._raiseError()
+
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+
+    def _raiseError(self):
+        if self.error:
+            error, self.error = self.error, None
+            raise RuntimeError("Writing checkpoint failed.") from error
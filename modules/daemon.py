@@ -0,0 +1,121 @@
+import os
+import json
+import socket
+import hashlib
+import tempfile
+import threading
+import socketserver
+from typing import Iterator
+
+
+# Socket path is derived from settings file location and modification time,
+# so a changed settings file doesn't get served by an outdated daemon.
+def socketPath(settingsPath : str) -> str:
+    path = os.path.abspath(settingsPath)
+    key = f"{path}:{os.path.getmtime(path)}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"clean-{digest}.sock")
+
+
+# Protocol: client sends one JSON line { "input" : ..., <generate() parameters> }.
+# Server answers with JSON lines { "text" : ... } and finishes with { "done" : true } or { "error" : ... }.
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        results = None
+        try:
+            # Malformed requests get an error reply as well.
+            request = json.loads(line)
+            input = request.pop("input")
+            results = self.server.model.generate(input, **request)
+            for text in results:
+                self._send({ "text" : text })
+            self._send({ "done" : True })
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            self._send({ "error" : f"{type(e).__name__}: {e}" })
+        finally:
+            # Stops generating for a client that went away.
+            if results is not None:
+                results.close()
+
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b'\n')
+        self.wfile.flush()
+
+
+# At most maxThreads requests are handled at once, further connections wait to be accepted.
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path : str, model, maxThreads : int = 16):
+        self.model = model
+        self.slots = threading.BoundedSemaphore(maxThreads)
+        if os.path.exists(path):
+            if DaemonClient.connect(path):
+                raise RuntimeError(f"Daemon already running on {path}")
+            os.remove(path)
+        super().__init__(path, _RequestHandler)
+
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class DaemonClient:
+    def __init__(self, path : str):
+        self.path = path
+
+
+    # Returns client if a daemon is listening on path, otherwise None.
+    @staticmethod
+    def connect(path : str):
+        if not os.path.exists(path):
+            return None
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+        except OSError:
+            return None
+        return DaemonClient(path)
+
+
+    def generate(self, input : str, **kwargs) -> Iterator[str]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.path)
+            with sock.makefile('rwb') as stream:
+                stream.write(json.dumps({ "input" : input, **kwargs }).encode() + b'\n')
+                stream.flush()
+
+                for line in stream:
+                    message = json.loads(line)
+                    if "text" in message:
+                        yield message["text"]
+                    elif "error" in message:
+                        raise RuntimeError(f"Daemon error: {message['error']}")
+                    else:
+                        return
+        raise ConnectionError("Daemon closed connection before finishing.")
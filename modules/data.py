@@ -7,24 +7,45 @@ from .template import Template
 
 # Note: If not template is used, input field of data is used for training.
 class DataProcessor:
-    def __init__(self, templatePath = None):
+    def __init__(self, templatePath = None, numProc = None):
+        self.templatePath = templatePath
         self.template = Template(templatePath)
+        self.numProc = numProc
 
 
     def _applyTemplate(self, data):
-        return { "input" : self.template.apply(**data) }
+        return { "input" : self.template.applyBatch(data) }
 
 
-    def loadData(self, dataPath, randomize=True, seed=None):
-        if dataPath.endswith(".json"):
-            dataset = datasets.load_dataset("json", data_files=dataPath)
+    # "prompt" is the template applied with an empty output, the part of "input" preceding the output.
+    def _applyTemplateWithPrompt(self, data):
+        count = len(next(iter(data.values())))
+        prompt = self.template.applyBatch({ **data, "output" : [""] * count })
+        return { "input" : self.template.applyBatch(data), "prompt" : prompt }
+
+
+    def loadData(self, dataPath, randomize=True, seed=None, streaming=False, bufferSize=10000, withPrompt=False):
+        if withPrompt and not self.template.hasTemplate():
+            raise ValueError("Separating prompt and output requires a template.")
+
+        if dataPath.endswith(".json") or dataPath.endswith(".jsonl"):
+            dataset = datasets.load_dataset("json", data_files=dataPath, streaming=streaming)
         else:
-            dataset = datasets.load_dataset(dataPath)
+            dataset = datasets.load_dataset(dataPath, streaming=streaming)
         
         data = dataset["train"]
         if randomize:
-            data = data.shuffle(seed=seed)
+            if streaming:
+                data = data.shuffle(seed=seed, buffer_size=bufferSize)
+            else:
+                data = data.shuffle(seed=seed)
         if self.template.hasTemplate():
-            data = data.map(self._applyTemplate)
+            apply = self._applyTemplateWithPrompt if withPrompt else self._applyTemplate
+            if streaming:
+                data = data.map(apply, batched=True)
+            else:
+                data = data.map(apply, batched=True, num_proc=self.numProc)
+        if streaming:
+            # Columns of streamed data are not known upfront. Only keep what gets tokenized.
+            data = data.select_columns(["input", "prompt"] if withPrompt else ["input"])
         return data
-            
@@ -0,0 +1,61 @@
+import os
+import json
+import shutil
+import hashlib
+
+import datasets
+
+
+# Stores tokenized training data on disk, keyed by everything that influences tokenization and
+# sample order. Cached data sets are loaded memory-mapped. Only the latest entry is kept.
+class DataCache:
+    def __init__(self, cacheDir : str):
+        self.cacheDir = cacheDir
+
+
+    def fingerprint(self, dataPath : str, templatePath : str, tokenizerIdentity : str, cutoff : int, packing : bool = False,
+                    seed : int = None) -> str:
+        key = {
+            "data" : _hashPath(dataPath),
+            "template" : _hashPath(templatePath),
+            "tokenizer" : tokenizerIdentity,
+            "cutoff" : cutoff,
+            "packing" : packing,
+            "seed" : seed
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+    def load(self, fingerprint : str) -> datasets.Dataset:
+        path = os.path.join(self.cacheDir, fingerprint)
+        if os.path.isdir(path):
+            return datasets.load_from_disk(path)
+        return None
+
+
+    def save(self, fingerprint : str, dataSet : datasets.Dataset) -> datasets.Dataset:
+        path = os.path.join(self.cacheDir, fingerprint)
+        tmpPath = path + ".tmp"
+        if os.path.isdir(tmpPath):
+            shutil.rmtree(tmpPath)
+
+        dataSet.save_to_disk(tmpPath)
+        os.replace(tmpPath, path)
+        for name in os.listdir(self.cacheDir):
+            if name != fingerprint:
+                shutil.rmtree(os.path.join(self.cacheDir, name), ignore_errors=True)
+        return datasets.load_from_disk(path)
+
+
+# Hashes file content if path is a local file, otherwise the path itself (e.g. hub data set name).
+def _hashPath(path : str) -> str:
+    if not path:
+        return None
+    if not os.path.isfile(path):
+        return path
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
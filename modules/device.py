@@ -0,0 +1,71 @@
+import os
+
+import torch
+from transformers.pytorch_utils import Conv1D
+
+
+dtypes = {
+    "float16" : torch.float16,
+    "bfloat16" : torch.bfloat16,
+    "float32" : torch.float32
+}
+
+
+# Distributed workers (LOCAL_RANK set) use one GPU each.
+def resolveDevice(device : str = None) -> str:
+    if device:
+        return device
+    if not torch.cuda.is_available():
+        return "cpu"
+    localRank = os.environ.get("LOCAL_RANK")
+    return f"cuda:{localRank}" if localRank else "cuda"
+
+
+# Default is float16 on GPU. On CPU bfloat16 is only fast with native support, otherwise float32.
+def resolveDtype(dtype : str, device : str) -> torch.dtype:
+    if dtype:
+        if dtype not in dtypes:
+            raise ValueError(f"Unsupported dtype: {dtype}. Use one of {', '.join(dtypes)}.")
+        return dtypes[dtype]
+    if device != "cpu":
+        return torch.float16
+    if getattr(torch.cpu, "_is_avx512_bf16_supported", lambda: False)():
+        return torch.bfloat16
+    return torch.float32
+
+
+# Inter-op threads can only be set before the first parallel operation of the process.
+def configureThreads(threads : int = None, interopThreads : int = None):
+    if threads:
+        torch.set_num_threads(threads)
+    if interopThreads and torch.get_num_interop_threads() != interopThreads:
+        try:
+            torch.set_num_interop_threads(interopThreads)
+        except RuntimeError:
+            print(f"Warning: Inter-op threads already in use, keeping {torch.get_num_interop_threads()}.")
+
+
+# CPU counterpart of 8 bit loading: linear layer weights are stored as int8, activations are
+# quantized on the fly. Requires float32 weights. GPT-2 style Conv1D layers are converted to linear
+# layers first. LoRA layers are small and stay as they are, peft needs their weights. Output
+# embeddings stay as well, they are often tied to the input embeddings and sensitive to quantization.
+def quantizeDynamic(model : torch.nn.Module) -> torch.nn.Module:
+    for name, module in list(model.named_modules()):
+        for childName, child in list(module.named_children()):
+            if type(child) is Conv1D and "lora_" not in f"{name}.{childName}":
+                setattr(module, childName, _linearFromConv1D(child))
+
+    outputEmbeddings = model.get_output_embeddings() if hasattr(model, "get_output_embeddings") else None
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    layers = { name : qconfig for name, module in model.named_modules()
+              if type(module) is torch.nn.Linear and "lora_" not in name and module is not outputEmbeddings }
+    return torch.ao.quantization.quantize_dynamic(model, layers, dtype=torch.qint8, inplace=True)
+
+
+# Conv1D weights are stored transposed (in x out).
+def _linearFromConv1D(conv : Conv1D) -> torch.nn.Linear:
+    weight = conv.weight.detach()
+    linear = torch.nn.Linear(weight.shape[0], weight.shape[1], dtype=weight.dtype, device=weight.device)
+    linear.weight.data = weight.t().contiguous()
+    linear.bias.data = conv.bias.detach().clone()
+    return linear
@@ -0,0 +1,84 @@
+import os
+from contextlib import contextmanager
+from typing import Callable, List
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def isDistributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank() -> int:
+    return dist.get_rank() if isDistributed() else 0
+
+
+def worldSize() -> int:
+    return dist.get_world_size() if isDistributed() else 1
+
+
+def isMainProcess() -> bool:
+    return rank() == 0
+
+
+# Main process runs the block first (e.g. writing a cache), the others follow once it is done.
+@contextmanager
+def mainProcessFirst():
+    if isDistributed() and not isMainProcess():
+        dist.barrier()
+    yield
+    if isDistributed() and isMainProcess():
+        dist.barrier()
+
+
+def sumAcrossProcesses(values : List[float]) -> List[float]:
+    return _reduce(values, dist.ReduceOp.SUM)
+
+
+def minAcrossProcesses(values : List[float]) -> List[float]:
+    return _reduce(values, dist.ReduceOp.MIN)
+
+
+def maxAcrossProcesses(values : List[float]) -> List[float]:
+    return _reduce(values, dist.ReduceOp.MAX)
+
+
+def _reduce(values : List[float], op) -> List[float]:
+    if not isDistributed():
+        return values
+    device = f"cuda:{torch.cuda.current_device()}" if dist.get_backend() == "nccl" else "cpu"
+    result = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(result, op=op)
+    return result.tolist()
+
+
+# Starts settings.distributed.processes workers on this node, each calling func(settings, *args)
+# as member of the process group. Global rank is nodeRank * processes + local rank. Workers
+# inherit the working directory, relative paths of the settings stay valid.
+def launchWorkers(func : Callable, settings, *args):
+    mp.spawn(_worker, args=(func, settings, args), nprocs=settings.distributed.processes, join=True)
+
+
+def _worker(localRank : int, func : Callable, settings, args):
+    ds = settings.distributed
+    size = ds.processes * ds.nodes
+    globalRank = ds.nodeRank * ds.processes + localRank
+    os.environ.update({
+        "MASTER_ADDR" : ds.masterAddr,
+        "MASTER_PORT" : str(ds.masterPort),
+        "RANK" : str(globalRank),
+        "LOCAL_RANK" : str(localRank),
+        "WORLD_SIZE" : str(size),
+        "LOCAL_WORLD_SIZE" : str(ds.processes)
+    })
+    # Cores are split between the processes of a node, unless threads are configured.
+    if not settings.base.threads:
+        settings.base.threads = max(1, (os.cpu_count() or 1) // ds.processes)
+
+    dist.init_process_group(ds.backend, rank=globalRank, world_size=size)
+    try:
+        func(settings, *args)
+    finally:
+        dist.destroy_process_group()
@@ -0,0 +1,305 @@
+import queue
+import asyncio
+from threading import Thread, Lock, Event
+from typing import List
+
+import torch
+from torch.nn.functional import pad
+
+from transformers import TextIteratorStreamer, TextStreamer
+
+from .sampling import sampleToken
+from .prefixcache import PrefixCache
+
+
+class GenerationRequest:
+    def __init__(self, inputIds : torch.Tensor, streamer : TextIteratorStreamer,
+                 limit : int = 128, temp : float = 0.1, top_p : float = 0.75, top_k : int = 40,
+                 adapter : str = None, weights : str = None):
+        self.inputIds = inputIds
+        self.streamer = streamer
+        self.adapter = adapter
+        # Identifies the weights the adapter generates with. Prefix cache entries are only shared
+        # between requests with the same weights, by default the same adapter.
+        self.weights = weights or adapter
+        self.limit = limit
+        self.temp = temp
+        self.top_p = top_p
+        self.top_k = top_k
+
+        self.generated = 0
+        self.error = None
+        self.done = Event()
+        self.cancelled = Event()
+
+
+    def finish(self, error : Exception = None):
+        self.error = error
+        self.streamer.end()
+        self.done.set()
+
+
+    def wait(self):
+        self.done.wait()
+        if self.error:
+            raise self.error
+
+
+    # Cancel token: the engine finishes the request before its next token, without an error.
+    # No effect on finished requests.
+    def cancel(self):
+        self.cancelled.set()
+
+
+# Streamer for asyncio consumers. The engine thread hands text to the event loop, no thread
+# blocks waiting for it. Iterate with "async for".
+class AsyncTextStreamer(TextStreamer):
+    def __init__(self, tokenizer, loop : asyncio.AbstractEventLoop, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+
+    def on_finalized_text(self, text : str, stream_end : bool = False):
+        # The loop may be gone if the consumer was cancelled, the engine must not fail on it.
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+            if stream_end:
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+        except RuntimeError:
+            pass
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self) -> str:
+        text = await self.queue.get()
+        if text is None:
+            raise StopAsyncIteration
+        return text
+
+
+# Continuous batching: all in-flight requests share one decode loop. New requests are prefilled
+# and merged into the batch between decode steps, finished ones are dropped from it.
+# Sequences are left-padded to a common length, padding is masked out via attention mask.
+class GenerationEngine:
+    def __init__(self, model, eosTokenId : int, maxBatchSize : int = 8, prefixCache : PrefixCache = None,
+                 mixedAdapters : bool = False):
+        self.model = model
+        self.eosTokenId = eosTokenId
+        self.maxBatchSize = maxBatchSize
+        self.prefixCache = prefixCache
+        # With several adapters loaded, each row of a batch selects its adapter (peft mixed batch inference).
+        self.mixedAdapters = mixedAdapters
+
+        self.pending = queue.Queue()
+        self.active : List[GenerationRequest] = []
+        # Total of generated tokens, for throughput measurements.
+        self.tokenCount = 0
+        self.cacheClass = None
+        self._reset()
+
+        self.thread = None
+        self.lock = Lock()
+        self.closed = False
+
+
+    def submit(self, request : GenerationRequest):
+        self.pending.put(request)
+        with self.lock:
+            if not self.thread or not self.thread.is_alive():
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+
+    # The worker thread ends once requests in flight are done, releasing cached prefixes.
+    # Requests submitted afterwards are not served.
+    def close(self):
+        self.pending.put(None)
+
+
+    def _reset(self):
+        self.past = None
+        self.attentionMask = None
+        self.positions = None
+        self.nextTokens = None
+
+
+    def _run(self):
+        # no_grad is thread local, so it has to be set up in the worker itself.
+        with torch.no_grad():
+            while self.active or not self.closed:
+                if not self.closed:
+                    self._admit(block=not self.active)
+                if self.active:
+                    try:
+                        self._step()
+                    except Exception as e:
+                        for request in self.active:
+                            request.finish(e)
+                        self.active = []
+                        self._reset()
+
+
+    def _admit(self, block : bool):
+        while len(self.active) < self.maxBatchSize:
+            try:
+                request = self.pending.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+            if request is None:
+                self.closed = True
+                return
+            if request.cancelled.is_set():
+                request.finish()
+                continue
+
+            try:
+                self._prefill(request)
+            except Exception as e:
+                request.finish(e)
+
+
+    def _prefill(self, request : GenerationRequest):
+        inputIds = request.inputIds
+        length = inputIds.shape[1]
+
+        start, past = 0, None
+        if self.prefixCache:
+            ids = inputIds[0].tolist()
+            start, past = self.prefixCache.lookup(request.weights, ids)
+
+        output = self.model(
+            input_ids=inputIds[:, start:],
+            attention_mask=torch.ones_like(inputIds),
+            position_ids=torch.arange(start, length, device=inputIds.device).unsqueeze(0),
+            past_key_values=self._fromLegacy(past) if past else None,
+            use_cache=True,
+            **self._adapterArgs([request])
+        )
+        past = self._toLegacy(output.past_key_values)
+        if self.prefixCache:
+            self.prefixCache.store(request.weights, ids, past)
+
+        token = self._sample(output.logits[:, -1, :], [request])[0]
+        if not self._emit(request, token):
+            self._join(request, past, token, length)
+
+
+    def _step(self):
+        device = self.attentionMask.device
+        attentionMask = torch.cat([self.attentionMask, torch.ones((len(self.active), 1), dtype=self.attentionMask.dtype, device=device)], dim=1)
+        output = self.model(
+            input_ids=self.nextTokens,
+            attention_mask=attentionMask,
+            position_ids=self.positions,
+            past_key_values=self._fromLegacy(self.past),
+            use_cache=True,
+            **self._adapterArgs(self.active)
+        )
+        self.past = self._toLegacy(output.past_key_values)
+        self.attentionMask = attentionMask
+        self.positions = self.positions + 1
+
+        tokens = self._sample(output.logits[:, -1, :], self.active)
+        self.nextTokens = tokens.unsqueeze(-1)
+
+        finished = [self._emit(request, token) for request, token in zip(self.active, tokens)]
+        if any(finished):
+            self._retire([i for i, f in enumerate(finished) if not f])
+
+
+    def _adapterArgs(self, requests : List[GenerationRequest]):
+        if self.mixedAdapters:
+            return { "adapter_names" : [r.adapter for r in requests] }
+        return {}
+
+
+    def _sample(self, logits : torch.Tensor, requests : List[GenerationRequest]) -> torch.Tensor:
+        return torch.stack([
+            sampleToken(logits[i], r.temp, r.top_p, r.top_k) for i, r in enumerate(requests)
+        ])
+
+
+    # Streams token to request and returns True if request is finished. Cancelled requests
+    # finish instead, their batch rows get dropped.
+    def _emit(self, request : GenerationRequest, token : torch.Tensor) -> bool:
+        if request.cancelled.is_set():
+            request.finish()
+            return True
+        request.streamer.put(token.view(1).cpu())
+        request.generated += 1
+        self.tokenCount += 1
+        if token.item() == self.eosTokenId or request.generated >= request.limit:
+            request.finish()
+            return True
+        return False
+
+
+    def _join(self, request : GenerationRequest, past, token : torch.Tensor, length : int):
+        device = token.device
+        attentionMask = torch.ones((1, length), dtype=torch.long, device=device)
+        position = torch.tensor([[length]], device=device)
+        nextToken = token.view(1, 1)
+
+        if not self.active:
+            self.past = past
+            self.attentionMask = attentionMask
+            self.positions = position
+            self.nextTokens = nextToken
+        else:
+            total = max(self.attentionMask.shape[1], length)
+            self.past = tuple(
+                tuple(torch.cat([_padLeft(a, total, -2), _padLeft(b, total, -2)]) for a, b in zip(batchLayer, layer))
+                for batchLayer, layer in zip(self.past, past)
+            )
+            self.attentionMask = torch.cat([_padLeft(self.attentionMask, total, -1), _padLeft(attentionMask, total, -1)])
+            self.positions = torch.cat([self.positions, position])
+            self.nextTokens = torch.cat([self.nextTokens, nextToken])
+
+        self.active.append(request)
+
+
+    def _retire(self, keep : List[int]):
+        self.active = [self.active[i] for i in keep]
+        if not self.active:
+            self._reset()
+            return
+
+        index = torch.tensor(keep, device=self.attentionMask.device)
+        attentionMask = self.attentionMask.index_select(0, index)
+        # Drops columns that are padding for all remaining sequences.
+        start = int(attentionMask.any(dim=0).int().argmax())
+
+        self.attentionMask = attentionMask[:, start:]
+        self.past = tuple(
+            tuple(t.index_select(0, index)[..., start:, :] for t in layer) for layer in self.past
+        )
+        self.positions = self.positions.index_select(0, index)
+        self.nextTokens = self.nextTokens.index_select(0, index)
+
+
+    # Batch manipulation works on the legacy tuple format ((key, value) per layer).
+    # Models that use cache classes get converted back and forth.
+    def _toLegacy(self, past):
+        if hasattr(past, "to_legacy_cache"):
+            self.cacheClass = type(past)
+            return past.to_legacy_cache()
+        return past
+
+
+    def _fromLegacy(self, past):
+        if self.cacheClass:
+            return self.cacheClass.from_legacy_cache(past)
+        return past
+
+
+def _padLeft(t : torch.Tensor, length : int, dim : int) -> torch.Tensor:
+    missing = length - t.shape[dim]
+    if missing == 0:
+        return t
+    padding = [0, 0] * (-dim - 1) + [missing, 0]
+    return pad(t, padding)
@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from .checkpoint import listCheckpoints
+
+
+# Reads tensor names, shapes and sizes from checkpoint headers without loading any weights.
+
+
+@dataclass
+class TensorInfo:
+    name : str
+    shape : List[int]
+    dtype : str
+    size : int
+
+    @property
+    def params(self) -> int:
+        count = 1
+        for dim in self.shape:
+            count *= dim
+        return count
+
+
+def readSafetensorsHeader(path : str) -> List[TensorInfo]:
+    with open(path, 'rb') as file:
+        length = struct.unpack('<Q', file.read(8))[0]
+        header = json.loads(file.read(length))
+
+    header.pop("__metadata__", None)
+    return [
+        TensorInfo(name, info["shape"], info["dtype"], info["data_offsets"][1] - info["data_offsets"][0])
+        for name, info in header.items()
+    ]
+
+
+# Pickled checkpoints have no header. Memory mapping avoids reading the tensor data.
+def readPytorchCheckpoint(path : str) -> List[TensorInfo]:
+    import torch
+    stateDict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    return [
+        TensorInfo(name, list(t.shape), str(t.dtype).replace("torch.", ""), t.numel() * t.element_size())
+        for name, t in stateDict.items()
+    ]
+
+
+def _checkpointFiles(path : str, prefix : str) -> List[str]:
+    for extension in ("safetensors", "bin"):
+        index = os.path.join(path, f"{prefix}.{extension}.index.json")
+        if os.path.isfile(index):
+            with open(index, 'r') as file:
+                weightMap = json.load(file)["weight_map"]
+            return [os.path.join(path, f) for f in sorted(set(weightMap.values()))]
+
+    for extension in ("safetensors", "bin"):
+        single = os.path.join(path, f"{prefix}.{extension}")
+        if os.path.isfile(single):
+            return [single]
+    return []
+
+
+def readCheckpoint(path : str, prefix : str = "model") -> List[TensorInfo]:
+    result = []
+    for f in _checkpointFiles(path, prefix):
+        if f.endswith(".safetensors"):
+            result.extend(readSafetensorsHeader(f))
+        else:
+            result.extend(readPytorchCheckpoint(f))
+    return result
+
+
+# Base model may be a local directory or a huggingface hub id. Hub models are read from
+# the local cache if available, otherwise only their safetensors headers are fetched.
+def readBaseModel(path : str) -> List[TensorInfo]:
+    if os.path.isdir(path):
+        return readCheckpoint(path) or readCheckpoint(path, "pytorch_model")
+
+    from huggingface_hub import snapshot_download, get_safetensors_metadata
+    try:
+        local = snapshot_download(path, local_files_only=True)
+        tensors = readCheckpoint(local) or readCheckpoint(local, "pytorch_model")
+        if tensors:
+            return tensors
+    except Exception:
+        pass
+
+    metadata = get_safetensors_metadata(path)
+    return [
+        TensorInfo(name, info.shape, info.dtype, info.data_offsets[1] - info.data_offsets[0])
+        for fileMetadata in metadata.files_metadata.values()
+        for name, info in fileMetadata.tensors.items()
+    ]
+
+
+# Adapter directory lookup as done by Model: finalized adapter wins over latest checkpoint.
+def findAdapter(path : str) -> str:
+    if not path or not os.path.isdir(path):
+        return None
+    if _checkpointFiles(path, "adapter_model"):
+        return path
+
+    checkpoints = [d for d in listCheckpoints(path) if _checkpointFiles(d, "adapter_model")]
+    return checkpoints[-1] if checkpoints else None
+
+
+# Groups tensors by module, layer numbers are collapsed (e.g. "model.layers.*.mlp.up_proj").
+def moduleTotals(tensors : List[TensorInfo]) -> Dict[str, Tuple[int, int, int]]:
+    totals = {}
+    for t in tensors:
+        module = re.sub(r'\.\d+(?=\.|$)', '.*', t.name.rsplit('.', 1)[0])
+        count, params, size = totals.get(module, (0, 0, 0))
+        totals[module] = (count + 1, params + t.params, size + t.size)
+    return totals
+
+
+# Linear layer weights are quantized when loading with 4 or 8 bits. Embeddings, output head,
+# biases and norms stay at 16 bits.
+def _isQuantizable(t : TensorInfo) -> bool:
+    return len(t.shape) == 2 and t.name.endswith(".weight") and not re.search(r'embed|wte|wpe|lm_head', t.name)
+
+
+def estimateMemory(tensors : List[TensorInfo], bits : int) -> int:
+    size = 0
+    for t in tensors:
+        if _isQuantizable(t):
+            size += t.params * bits // 8
+        else:
+            size += t.params * 2
+    return size
@@ -0,0 +1,39 @@
+import os
+import json
+import hashlib
+
+
+# A merged model (base weights with adapter folded in) is only valid for the base model
+# and adapter content it was created from. Both are recorded next to the merged weights.
+mergeInfoFileName = "merge.json"
+
+
+def mergedModelPath(settings) -> str:
+    return settings.training.outputPath + "-merged"
+
+
+def adapterHash(adapterPath : str) -> str:
+    digest = hashlib.sha256()
+    for fileName in sorted(os.listdir(adapterPath)):
+        path = os.path.join(adapterPath, fileName)
+        if not fileName.startswith("adapter_") or not os.path.isfile(path):
+            continue
+        digest.update(fileName.encode())
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def writeMergeInfo(mergedPath : str, basePath : str, adapterHash : str):
+    with open(os.path.join(mergedPath, mergeInfoFileName), 'w') as file:
+        json.dump({ "base" : basePath, "adapterHash" : adapterHash }, file)
+
+
+def isMergeCurrent(mergedPath : str, basePath : str, adapterHash : str) -> bool:
+    infoPath = os.path.join(mergedPath, mergeInfoFileName)
+    if not os.path.isfile(infoPath):
+        return False
+    with open(infoPath, 'r') as file:
+        info = json.load(file)
+    return info.get("base") == basePath and info.get("adapterHash") == adapterHash
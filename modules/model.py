@@ -1,18 +1,22 @@
 import os
 import re
-from typing import Iterator, List, Tuple
-from threading import Thread
-
-from torch import tensor, float16, no_grad, arange, mm # pylint: disable=no-name-in-module
+import json
+import shutil
+import asyncio
+import hashlib
+import numpy
+from typing import AsyncIterator, Iterator, List, Tuple
+
+from torch import tensor, full, zeros, long, float16, bfloat16, float32, no_grad, arange, mm # pylint: disable=no-name-in-module
 from torch.nn.functional import cosine_similarity
 
+from datasets import IterableDataset, Features, Sequence, Value
+
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
-    Trainer,
     TrainingArguments,
     DataCollatorForSeq2Seq,
-    GenerationConfig,
     TextIteratorStreamer
 )
 from peft import (
@@ -23,6 +27,31 @@ from peft import (
 )
 
 from .settings import Settings, TrainingSettings
+from .data import DataProcessor
+from .datacache import DataCache
+from .packing import SequencePacker, PackedCollator, paddingRatio, usesFlashAttention
+from .engine import GenerationEngine, GenerationRequest, AsyncTextStreamer
+from .prefixcache import PrefixCache
+from .speculative import SpeculativeEngine
+from .responsecache import ResponseCache
+from .trainer import ModelTrainer
+from .telemetry import TrainingTelemetry
+from .checkpoint import latestCheckpoint
+from .sampler import TokenBudgetBatchSampler
+from .scoring import sequenceLogLikelihoods, ignoreIndex
+from .distributed import rank, worldSize, isMainProcess, minAcrossProcesses, maxAcrossProcesses
+from .autotune import tuneBatchSize, probeTrainingStep, memoryBudget
+from .device import resolveDevice, resolveDtype, configureThreads, quantizeDynamic
+from .merging import adapterHash, isMergeCurrent, writeMergeInfo, mergedModelPath
+
+tokenizedFeatures = Features({ column : Sequence(Value("int64")) for column in ["input_ids", "attention_mask", "labels"] })
+packedFeatures = Features({ column : Sequence(Value("int64")) for column in ["input_ids", "attention_mask", "labels", "position_ids"] })
+
+# peft adapter names: the adapter of the settings file is "default", "__base__" disables adapters for a request
+defaultAdapter = "default"
+# Batches are padded to a multiple of this length.
+padMultiple = 8
+baseAdapter = "__base__"
 
 # Tokenizer class exists to limit the scope of serialization in .map(). Avoids serializing entire model.
 class Tokenizer:
@@ -50,22 +79,36 @@ class Tokenizer:
         self.tokenizer.add_eos_token = enable
 
 
-class Model:
-    device = "cuda"
+    # Identifies everything about the tokenizer that affects tokenize() results.
+    def identity(self) -> str:
+        tokenizer = self.tokenizer
+        if hasattr(tokenizer, "backend_tokenizer"):
+            content = tokenizer.backend_tokenizer.to_str()
+        else:
+            content = json.dumps(tokenizer.get_vocab(), sort_keys=True)
+        eos = getattr(tokenizer, "add_eos_token", None)
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        return f"{type(tokenizer).__name__}:{tokenizer.name_or_path}:{eos}:{digest}"
 
+
+class Model:
     def __init__(self, settings : Settings, trainable=True):
         assert settings.base.bits in (4, 8, 16), '"bits" must be 4, 8 or 16'
         self.settings = settings
-        self.model = AutoModelForCausalLM.from_pretrained(
-            settings.base.path,
-            load_in_8bit=(settings.base.bits == 8),
-            torch_dtype=float16
-        )
 
-        if settings.base.bits >= 16:
-            self.model = self.model.to(self.device)
-        else:
-            self.model = prepare_model_for_kbit_training(self.model)
+        base = settings.base
+        self.device = resolveDevice(base.device)
+        self.dtype = resolveDtype(base.dtype, self.device)
+        configureThreads(base.threads, base.interopThreads)
+
+        # CPU has no bitsandbytes quantization. Inference uses dynamic int8 quantization instead,
+        # training runs unquantized.
+        quantizeLoad = base.bits < 16 and self.device != "cpu"
+        self.quantizeDynamic = base.bits < 16 and self.device == "cpu" and not trainable
+        if base.bits < 16 and self.device == "cpu" and trainable:
+            print(f"Quantized training not available on CPU, training with {self.dtype}.")
+        if self.quantizeDynamic:
+            self.dtype = float32
 
         adset = settings.adapter
         if adset.type != "LoRA":
@@ -75,7 +118,32 @@ class Model:
         path = self._findLoadableModel(settings.training.outputPath)
         if not path:
             path = self._findLoadableModel(adset.path)
-        print(f"Loading adapter from: {path}")
+        self.adapterPath = path
+
+        # for inference, a merged model wins over base model + adapter if it is up to date
+        # (not when serving additional adapters, these need the original base weights)
+        basePath = settings.base.path
+        self.merged = False
+        extraAdapters = settings.inference.adapters if not trainable else None
+        if path and not trainable and not extraAdapters and isMergeCurrent(self.mergedPath(), basePath, adapterHash(path)):
+            basePath = self.mergedPath()
+            self.merged = True
+
+        self.model = AutoModelForCausalLM.from_pretrained(
+            basePath,
+            load_in_8bit=(quantizeLoad and base.bits == 8),
+            torch_dtype=self.dtype
+        )
+
+        if not quantizeLoad:
+            self.model = self.model.to(self.device)
+        else:
+            self.model = prepare_model_for_kbit_training(self.model)
+
+        if self.merged:
+            print(f"Loaded merged model from: {basePath}")
+        else:
+            print(f"Loading adapter from: {path}")
 
         if trainable:
             if not adset.loraModules:
@@ -85,12 +153,12 @@ class Model:
                 trainable = False
                 print("Disabling trainable. No training data path found in settings.")
 
-        if path:
+        if path and not self.merged:
             self.model = PeftModel.from_pretrained(
                 self.model,
                 path,
                 is_trainable=True,
-                torch_dtype=float16
+                torch_dtype=self.dtype
             )
         elif trainable:
             config = LoraConfig(
@@ -103,16 +171,83 @@ class Model:
             )
             self.model = get_peft_model(self.model, config)
 
+        self.adapters = {}
+        if path and not self.merged:
+            self.adapters[defaultAdapter] = path
+        if extraAdapters:
+            self._loadAdapters(extraAdapters)
+        if self.quantizeDynamic:
+            print("Quantizing linear layers to int8 (dynamic).")
+            self.model = quantizeDynamic(self.model.eval())
+
 # Trainer appears to be broken for compiled model (doesnt collect proper columns from dataset)
 #		self.model = torch.compile(self.model)
 
         self.tokenizer = Tokenizer(settings.base.path, settings.training.cutoff)
+        self.engine = None
+        self.embeddingIndex = None
+
+        inset = settings.inference
+        self.responseCache = None
+        self.fingerprints = {}
+        if inset.responseCacheEntries > 0 and not trainable:
+            self.responseCache = ResponseCache(inset.responseCacheEntries, ttl=inset.responseCacheTTL, path=inset.responseCachePath)
+
+
+    # Additional adapters share the resident base model, only their LoRA weights get loaded.
+    def _loadAdapters(self, adapters):
+        for name, adapterPath in adapters.items():
+            path = self._findLoadableModel(adapterPath)
+            if not path:
+                raise ValueError(f"No adapter found for {name} in {adapterPath}")
+            print(f"Loading adapter {name} from: {path}")
+
+            if isinstance(self.model, PeftModel):
+                self.model.load_adapter(path, adapter_name=name)
+            else:
+                self.model = PeftModel.from_pretrained(self.model, path, adapter_name=name)
+            self.adapters[name] = path
+        self.model.eval()
+
+
+    def adapterNames(self) -> List[str]:
+        return list(self.adapters)
 
 
     def _modelFinalized(self, outputPath):
-        modelFileName1 = os.path.join(outputPath, "adapter_model.bin")
-        modelFileName2 = os.path.join(outputPath, "model.bin")
-        return os.path.isfile(modelFileName1) or os.path.isfile(modelFileName2)
+        modelFileNames = ["adapter_model.bin", "adapter_model.safetensors", "model.bin"]
+        return any(os.path.isfile(os.path.join(outputPath, f)) for f in modelFileNames)
+
+
+    def mergedPath(self) -> str:
+        return mergedModelPath(self.settings)
+
+
+    # Folds adapter into base weights and saves the result as standalone model.
+    def mergeAdapter(self) -> str:
+        path = self.mergedPath()
+        if self.merged:
+            return path
+        if not isinstance(self.model, PeftModel):
+            raise ValueError("No adapter loaded. Nothing to merge.")
+        if len(self.adapters) > 1:
+            raise ValueError("Only a single adapter can be merged.")
+        if self.settings.base.bits < 16:
+            raise ValueError('Merging requires an unquantized base model ("bits" : 16).')
+
+        self.model = self.model.merge_and_unload()
+        self.merged = True
+        self._closeEngine()
+        self.embeddingIndex = None
+
+        tmpPath = path + ".tmp"
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        self.model.save_pretrained(tmpPath)
+        self.tokenizer.tokenizer.save_pretrained(tmpPath)
+        writeMergeInfo(tmpPath, self.settings.base.path, adapterHash(self.adapterPath))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmpPath, path)
+        return path
 
 
     def _ensureNotOverwriting(self, outputPath):
@@ -123,11 +258,7 @@ class Model:
 
 
     def _findLatestCheckpoint(self, outputPath):
-        if os.path.isdir(outputPath):
-            subdirs = [os.path.join(outputPath, d) for d in os.listdir(outputPath) if os.path.isdir(os.path.join(outputPath, d))]
-            if subdirs:
-                return max(subdirs, key=os.path.getmtime)
-        return None
+        return latestCheckpoint(outputPath)
 
 
     def _findLoadableModel(self, path):
@@ -137,6 +268,51 @@ class Model:
         return self._findLatestCheckpoint(path)
 
 
+    def _tokenizeData(self, dataSet):
+        trset = self.settings.training
+        if isinstance(dataSet, IterableDataset):
+            # Streamed data sets only know their columns if features are given. DataProcessor
+            # reduces them to "input". Packing replaces all columns, removing them would drop the result.
+            tokenizeArgs = { "remove_columns" : dataSet.column_names or ["input"], "features" : tokenizedFeatures }
+            packArgs = { "features" : packedFeatures }
+        else:
+            workers = trset.dataWorkers if trset.dataWorkers > 1 else None
+            tokenizeArgs = { "remove_columns" : dataSet.column_names, "num_proc" : workers }
+            # Packing runs in one process, each process would leave a partly filled block behind.
+            packArgs = {}
+
+        dataSet = dataSet.map(self.tokenizer.tokenize, batched=True, **tokenizeArgs)
+
+        if trset.packing:
+            tokenizer = self.tokenizer.tokenizer
+            packer = SequencePacker(trset.cutoff, tokenizer.eos_token_id, tokenizer.pad_token_id)
+            if not isinstance(dataSet, IterableDataset):
+                packArgs["remove_columns"] = dataSet.column_names
+            dataSet = dataSet.map(packer.pack, batched=True, **packArgs)
+        return dataSet
+
+
+    # Loads and tokenizes training data. Result is cached next to the output path.
+    def prepareData(self, dataProcessor : DataProcessor):
+        trset = self.settings.training
+        self.tokenizer.addEOSToken(True)
+        if trset.streaming:
+            dataSet = dataProcessor.loadData(trset.dataPath, seed=trset.seed, streaming=True, bufferSize=trset.shuffleBuffer)
+            return self._tokenizeData(dataSet)
+        if not trset.dataCache:
+            return self._tokenizeData(dataProcessor.loadData(trset.dataPath, seed=trset.seed))
+
+        cache = DataCache(trset.outputPath + "-cache")
+        fingerprint = cache.fingerprint(trset.dataPath, dataProcessor.templatePath, self.tokenizer.identity(), trset.cutoff, trset.packing, trset.seed)
+        dataSet = cache.load(fingerprint)
+        if dataSet is not None:
+            print(f"Loaded tokenized training data from cache ({fingerprint}).")
+            return dataSet
+
+        dataSet = self._tokenizeData(dataProcessor.loadData(trset.dataPath, seed=trset.seed))
+        return cache.save(fingerprint, dataSet)
+
+
     def train(self, dataSet):
         trset = self.settings.training
         self._ensureNotOverwriting(trset.outputPath)
@@ -149,83 +325,420 @@ class Model:
         else:
             print("Starting new fine-tune.")
 
-        if len(dataSet) < trset.batchSize * trset.accumulationSteps:
+        # Fails early if packed samples can't be kept apart.
+        flashAttention = usesFlashAttention(self.model.config) if trset.packing else False
+
+        streaming = isinstance(dataSet, IterableDataset)
+        if streaming:
+            if not trset.maxSteps:
+                raise ValueError('Streamed training data requires "maxSteps" in training settings.')
+        elif len(dataSet) < trset.batchSize * trset.accumulationSteps:
             print("Warning: Not enough data to fill gradient accumulation steps and/or batch size.")
 
         self.model.print_trainable_parameters()
 
+        if "input_ids" in (dataSet.column_names or []):
+            preparedDataSet = dataSet
+        else:
+            preparedDataSet = self._tokenizeData(dataSet)
+
+        tuning = self._autoTune(preparedDataSet, streaming) if trset.autoTune else None
+
+        # Token budget batches are length grouped. Accumulation is adjusted, so an optimizer
+        # step still sees about batchSize * accumulationSteps samples.
+        batchSampler = None
+        accumulationSteps = trset.accumulationSteps
+        if trset.tokensPerBatch:
+            if streaming:
+                raise ValueError('"tokensPerBatch" is not supported for streamed training data.')
+            lengths = [len(ids) for ids in preparedDataSet["input_ids"]]
+            batchSampler = TokenBudgetBatchSampler(lengths, trset.tokensPerBatch, seed=trset.seed, rank=rank(), processes=worldSize(),
+                                                   lengthMultiple=padMultiple)
+            accumulationSteps = batchSampler.accumulationSteps(trset.batchSize * trset.accumulationSteps)
+            if isMainProcess():
+                print(f"Token budget of {trset.tokensPerBatch}: {len(batchSampler.batches)} batches, {accumulationSteps} accumulation steps.")
+
+        # Data parallel processes each contribute a batch per micro step. Accumulation is divided
+        # between them, so an optimizer step sees the same number of samples as with one process.
+        processes = worldSize()
+        if processes > 1:
+            accumulationSteps = max(1, round(accumulationSteps / processes))
+            if isMainProcess():
+                print(f"Training on {processes} processes, {accumulationSteps} accumulation steps per process.")
+
         args = TrainingArguments(
             per_device_train_batch_size=trset.batchSize,
-            gradient_accumulation_steps=trset.accumulationSteps,
-            group_by_length=trset.groupByLength,
+            gradient_accumulation_steps=accumulationSteps,
+            group_by_length=trset.groupByLength and not streaming and not batchSampler,
             warmup_steps=trset.warmupSteps,
             num_train_epochs=trset.epochs,
+            max_steps=trset.maxSteps or -1,
             learning_rate=trset.learningRate,
             weight_decay=trset.weightDecay,
-            fp16=True,
+            fp16=(self.dtype == float16 and self.device != "cpu"),
+            bf16=(self.dtype == bfloat16),
+            use_cpu=(self.device == "cpu"),
             logging_steps=trset.loggingSteps,
             optim="adamw_torch",
             save_strategy="steps",
             save_steps=trset.checkpointSteps,
             output_dir=trset.outputPath,
-            save_total_limit=trset.checkpointLimit
+            save_total_limit=trset.checkpointLimit,
+            gradient_checkpointing=trset.gradientCheckpointing,
+            gradient_checkpointing_kwargs={ "use_reentrant" : False },
+            ddp_backend=self.settings.distributed.backend if processes > 1 else None,
+            # All LoRA weights get gradients, no need to search for unused ones every step
+            ddp_find_unused_parameters=False
         )
-        preparedDataSet = dataSet.map(self.tokenizer.tokenize)
-        trainer = Trainer(
+
+        if trset.packing and not streaming:
+            print(f"Packed training data into {len(preparedDataSet)} blocks. Padding ratio: {paddingRatio(preparedDataSet, trset.cutoff):.1%}")
+        if trset.packing:
+            # Blocks are of equal length, no padding needed.
+            collator = PackedCollator(self.dtype, flashAttention)
+        else:
+            collator = DataCollatorForSeq2Seq(
+                self.tokenizer.tokenizer, pad_to_multiple_of=padMultiple, return_tensors="pt", padding=True
+            )
+
+        trainer = ModelTrainer(
             model=self.model,
             train_dataset=preparedDataSet,
             args=args,
-            data_collator=DataCollatorForSeq2Seq(
-                self.tokenizer.tokenizer, pad_to_multiple_of=8, return_tensors="pt", padding=True
-            ),
+            data_collator=collator,
+            telemetry=TrainingTelemetry(trset.outputPath, tuning=tuning) if trset.telemetry else None,
+            asyncCheckpoints=trset.asyncCheckpoints,
+            batchSampler=batchSampler
         )
         self.model.config.use_cache = False
         trainer.train(resume_from_checkpoint=checkpoint)
-        self.model.save_pretrained(trset.outputPath)
-
+        self.embeddingIndex = None
+        self.fingerprints = {}
+        if self.responseCache:
+            self.responseCache.clear()
+        self._closeEngine()
+        if isMainProcess():
+            self.model.save_pretrained(trset.outputPath)
+
+
+    # Probes the largest micro batch that fits at a high percentile of training sample lengths
+    # (autoTuneLengthPercentile) and replaces batchSize and accumulationSteps of the training settings,
+    # keeping batchSize * accumulationSteps samples per optimizer step. Batches of longer samples only
+    # stay within memory with a token budget (tokensPerBatch). If memory limits the batch below that,
+    # gradient checkpointing is probed as well and used if it gives more throughput. With several
+    # processes, all use the smallest batch found.
+    def _autoTune(self, dataSet, streaming : bool) -> dict:
+        trset = self.settings.training
+        samplesPerStep = trset.batchSize * trset.accumulationSteps
+        if streaming or trset.packing:
+            length, maxBatchSize = trset.cutoff, samplesPerStep
+        else:
+            lengths = [len(ids) for ids in dataSet["input_ids"]]
+            length = int(numpy.ceil(numpy.percentile(lengths, trset.autoTuneLengthPercentile)))
+            maxBatchSize = min(samplesPerStep, len(dataSet))
+        processes = self.settings.distributed.processes if worldSize() > 1 else 1
+        budget = memoryBudget(self.device, trset.autoTuneMemory, processes=processes)
 
-    def generate(self, input : str, limit : int = 128, temp : float = 0.1, top_p : float = 0.75, top_k : int = 40) -> Iterator[str]:
+        self.model.config.use_cache = False
+        self.model.train()
+        def tune(checkpointing):
+            self._setGradientCheckpointing(checkpointing)
+            batchSize, probes = tuneBatchSize(lambda b: probeTrainingStep(self.model, b, length, self.device), maxBatchSize, budget)
+            limited = any(p is None or (budget and p[1] > budget) for p in probes.values())
+            return batchSize, probes.get(batchSize), limited
+
+        candidates = []
+        batchSize, probe, limited = tune(trset.gradientCheckpointing)
+        if batchSize:
+            candidates.append((batchSize / probe[0], batchSize, trset.gradientCheckpointing, probe))
+        if limited and not trset.gradientCheckpointing and (batchSize or 0) < maxBatchSize:
+            batchSize, probe, _ = tune(True)
+            if batchSize:
+                candidates.append((batchSize / probe[0], batchSize, True, probe))
+        if not candidates:
+            raise RuntimeError(f"A single sample of {length} tokens doesn't fit into memory. Reduce \"cutoff\".")
+
+        samplesPerSecond, batchSize, checkpointing, (stepTime, peakMemory, _) = max(candidates)
+        batchSize = int(minAcrossProcesses([batchSize])[0])
+        checkpointing = bool(maxAcrossProcesses([checkpointing])[0])
+        self._setGradientCheckpointing(checkpointing)
+
+        trset.batchSize = batchSize
+        trset.accumulationSteps = max(1, round(samplesPerStep / batchSize))
+        trset.gradientCheckpointing = checkpointing
+        if trset.tokensPerBatch:
+            trset.tokensPerBatch = batchSize * length
+        if isMainProcess():
+            print(f"Auto tune at {length} tokens: batch size {batchSize}, {trset.accumulationSteps} accumulation steps,"
+                  f" gradient checkpointing {'on' if checkpointing else 'off'}, {samplesPerSecond * length:.0f} tokens/sec,"
+                  f" peak memory {peakMemory / 1024**2:.0f} MB")
+            print(f"Training: {vars(trset)}")
+
+        return {
+            "length" : length,
+            "batchSize" : batchSize,
+            "accumulationSteps" : trset.accumulationSteps,
+            "gradientCheckpointing" : checkpointing,
+            "tokensPerBatch" : trset.tokensPerBatch,
+            "tokensPerSecond" : samplesPerSecond * length,
+            "peakMemory" : peakMemory,
+            "memoryBudget" : budget
+        }
+
+
+    def _setGradientCheckpointing(self, enabled : bool):
+        if enabled:
+            self.model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={ "use_reentrant" : False })
+        else:
+            self.model.gradient_checkpointing_disable()
+
+
+    def generate(self, input : str, limit : int = 128, temp : float = 0.1, top_p : float = 0.75, top_k : int = 40,
+                 adapter : str = None) -> Iterator[str]:
+        adapter = self._resolveAdapter(adapter)
+        cacheKey, chunks = self._cachedResponse(input, limit, temp, top_p, top_k, adapter)
+        if chunks is not None:
+            yield from chunks
+            return
+
+        streamer = TextIteratorStreamer(self.tokenizer.tokenizer)
+        request = self._submit(input, streamer, limit, temp, top_p, top_k, adapter)
+        eosPattern = self._eosPattern()
+        chunks = []
+        # Generation stops if the generator gets closed early (disconnected client, Ctrl-C).
+        try:
+            for text in streamer:
+                if eosPattern:
+                    text = eosPattern.sub('', text)
+                chunks.append(text)
+                yield text
+            request.wait()
+        finally:
+            request.cancel()
+        if cacheKey:
+            self.responseCache.store(cacheKey, chunks)
+
+
+    # Same as generate() for asyncio. Waiting for text doesn't occupy a thread, cancelling the
+    # consuming task stops the generation.
+    async def generateAsync(self, input : str, limit : int = 128, temp : float = 0.1, top_p : float = 0.75, top_k : int = 40,
+                            adapter : str = None) -> AsyncIterator[str]:
+        adapter = self._resolveAdapter(adapter)
+        cacheKey, chunks = self._cachedResponse(input, limit, temp, top_p, top_k, adapter)
+        if chunks is not None:
+            for text in chunks:
+                yield text
+            return
+
+        streamer = AsyncTextStreamer(self.tokenizer.tokenizer, asyncio.get_running_loop())
+        request = self._submit(input, streamer, limit, temp, top_p, top_k, adapter)
+        eosPattern = self._eosPattern()
+        chunks = []
+        try:
+            async for text in streamer:
+                if eosPattern:
+                    text = eosPattern.sub('', text)
+                chunks.append(text)
+                yield text
+        finally:
+            request.cancel()
+        if request.error:
+            raise request.error
+        if cacheKey:
+            self.responseCache.store(cacheKey, chunks)
+
+
+    def _resolveAdapter(self, adapter : str) -> str:
+        if adapter and adapter not in self.adapters:
+            raise ValueError(f"Unknown adapter: {adapter}")
+        if not adapter:
+            # Without a default adapter, peft runs the first one loaded.
+            adapter = defaultAdapter if defaultAdapter in self.adapters else next(iter(self.adapters), baseAdapter)
+        return adapter
+
+
+    # Low temperature responses are replayed from the cache. Returns the cache key (None if not
+    # cacheable) and the cached chunks, if any. Only completed generations get stored.
+    def _cachedResponse(self, input : str, limit : int, temp : float, top_p : float, top_k : int, adapter : str) -> Tuple[str, List[str]]:
+        if not self.responseCache or temp > self.settings.inference.responseCacheMaxTemp:
+            return None, None
+        cacheKey = ResponseCache.key(self._fingerprint(adapter), input, limit, temp, top_p, top_k)
+        return cacheKey, self.responseCache.lookup(cacheKey)
+
+
+    def _submit(self, input : str, streamer, limit : int, temp : float, top_p : float, top_k : int, adapter : str) -> GenerationRequest:
         self.model.config.use_cache = True
         self.tokenizer.addEOSToken(False)
-        tokenizer = self.tokenizer.tokenizer
-
-        if tokenizer.eos_token:
-            eosPattern = re.compile(re.escape(tokenizer.eos_token) + '$')
-        else:
-            eosPattern = None
-
-        inputs = tokenizer(input, return_tensors="pt")
-        input_ids = inputs["input_ids"].to(self.model.device)
+        inputs = self.tokenizer.tokenizer(input, return_tensors="pt")
 
-        config = GenerationConfig(
-            temperature=temp,
+        request = GenerationRequest(
+            inputs["input_ids"].to(self.model.device),
+            streamer,
+            limit=limit,
+            temp=temp,
             top_p=top_p,
             top_k=top_k,
-            num_beams=1,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.pad_token_id
+            adapter=adapter,
+            weights=self._fingerprint(adapter)
         )
+        self._getEngine().submit(request)
+        return request
+
+
+    def _eosPattern(self):
+        eosToken = self.tokenizer.tokenizer.eos_token
+        return re.compile(re.escape(eosToken) + '$') if eosToken else None
+
+
+    # Identifies the weights generating for an adapter: base model, adapter file contents and precision.
+    def _fingerprint(self, adapter : str) -> str:
+        if adapter not in self.fingerprints:
+            base = self.settings.base
+            path = self.adapterPath if self.merged else self.adapters.get(adapter)
+            contents = adapterHash(path) if path else ""
+            self.fingerprints[adapter] = f"{base.path}:{contents}:{base.bits}:{self.dtype}:{self.merged}"
+        return self.fingerprints[adapter]
+
+
+    # Offline generation of many inputs, yields (index, output) per input as batches finish.
+    # Inputs are sorted by length, so left padded batches hold little padding. Longest come
+    # first, running out of memory shows right away.
+    def generateBatch(self, inputs : List[str], batchSize : int = 8, limit : int = 128, temp : float = 0.1,
+                      top_p : float = 0.75, top_k : int = 40) -> Iterator[Tuple[int, str]]:
+        self.model.config.use_cache = True
+        self.tokenizer.addEOSToken(False)
+        tokenizer = self.tokenizer.tokenizer
 
-        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True)
+        lengths = [len(ids) for ids in tokenizer(inputs)["input_ids"]]
+        order = sorted(range(len(inputs)), key=lambda i: lengths[i], reverse=True)
+        sampling = { "do_sample" : True, "temperature" : temp, "top_p" : top_p, "top_k" : int(top_k) } if temp > 0 else { "do_sample" : False }
+
+        for start in range(0, len(order), batchSize):
+            indices = order[start:start + batchSize]
+            batch = tokenizer([inputs[i] for i in indices], padding=True, return_tensors="pt").to(self.device)
+            with no_grad():
+                output = self.model.generate(
+                    input_ids=batch["input_ids"],
+                    attention_mask=batch["attention_mask"],
+                    max_new_tokens=limit,
+                    pad_token_id=tokenizer.pad_token_id,
+                    eos_token_id=tokenizer.eos_token_id,
+                    **sampling
+                )
+            for i, sequence in zip(indices, output[:, batch["input_ids"].shape[1]:].tolist()):
+                # Rows finished before others are filled up with padding, which can be a regular token.
+                if tokenizer.eos_token_id in sequence:
+                    sequence = sequence[:sequence.index(tokenizer.eos_token_id)]
+                yield i, tokenizer.decode(sequence, skip_special_tokens=True)
+
+
+    # Log-likelihood of each row of a data set loaded by DataProcessor, yields (index, log-likelihood,
+    # scored token count) as batches finish. Texts are tokenized as for training. With outputOnly, tokens
+    # of the "prompt" column (DataProcessor withPrompt) are not scored. Rows are sorted by length and
+    # right padded, so positions are the same as without padding.
+    def score(self, dataSet, batchSize : int = 8, outputOnly : bool = False) -> Iterator[Tuple[int, float, int]]:
+        if outputOnly and "prompt" not in dataSet.column_names:
+            raise ValueError('Scoring the output only requires a "prompt" column.')
 
-        kwargs = dict(
-            input_ids=input_ids,
-            generation_config=config,
-            return_dict_in_generate=True,
-            output_scores=True,
-            max_new_tokens=limit,
-            streamer=streamer
+        tokenizer = self.tokenizer.tokenizer
+        promptLengths = None
+        if outputOnly:
+            self.tokenizer.addEOSToken(False)
+            promptLengths = [len(ids) for ids in tokenizer(dataSet["prompt"])["input_ids"]]
+        self.tokenizer.addEOSToken(True)
+        tokenized = tokenizer(dataSet["input"], truncation=True, max_length=self.settings.training.cutoff)["input_ids"]
+
+        order = sorted(range(len(tokenized)), key=lambda i: len(tokenized[i]), reverse=True)
+        self.model.eval()
+        for start in range(0, len(order), batchSize):
+            indices = order[start:start + batchSize]
+            width = len(tokenized[indices[0]])
+            if width < 2:
+                for i in indices:
+                    yield i, 0.0, 0
+                continue
+
+            ids = full((len(indices), width), tokenizer.pad_token_id, dtype=long)
+            mask = zeros((len(indices), width), dtype=long)
+            labels = full((len(indices), width), ignoreIndex, dtype=long)
+            for row, i in enumerate(indices):
+                length = len(tokenized[i])
+                ids[row, :length] = tensor(tokenized[i])
+                mask[row, :length] = 1
+                first = promptLengths[i] if outputOnly else 0
+                labels[row, first:length] = ids[row, first:length]
+
+            with no_grad():
+                logits = self.model(input_ids=ids.to(self.device), attention_mask=mask.to(self.device)).logits
+            logLikelihoods, counts = sequenceLogLikelihoods(logits, labels.to(self.device))
+            for i, logLikelihood, count in zip(indices, logLikelihoods.tolist(), counts.tolist()):
+                yield i, logLikelihood, count
+
+
+    # First passes are slow (allocations, kernel selection), done before serving requests.
+    # Generates without the response cache, a cached warmup response would skip the setup it is for.
+    def warmup(self):
+        streamer = TextIteratorStreamer(self.tokenizer.tokenizer)
+        request = self._submit("Hello", streamer, 4, 0, 0.75, 40, self._resolveAdapter(None))
+        for _ in streamer:
+            pass
+        request.wait()
+
+
+    # After the weights changed. Cached prefixes hold keys and values of the old ones.
+    def _closeEngine(self):
+        if self.engine:
+            self.engine.close()
+            self.engine = None
+
+
+    def _getEngine(self) -> GenerationEngine:
+        if not self.engine:
+            inset = self.settings.inference
+            prefixCache = None
+            if inset.prefixCacheSize > 0:
+                prefixCache = PrefixCache(inset.prefixCacheSize * 1024 * 1024, minLength=inset.prefixMinLength)
+
+            if inset.draftPath:
+                self.engine = SpeculativeEngine(
+                    self.model,
+                    self._loadDraftModel(inset.draftPath),
+                    self.tokenizer.tokenizer.eos_token_id,
+                    draftTokens=inset.draftTokens,
+                    mixedAdapters=len(self.adapters) > 1
+                )
+            else:
+                self.engine = GenerationEngine(
+                    self.model,
+                    self.tokenizer.tokenizer.eos_token_id,
+                    maxBatchSize=inset.maxBatchSize,
+                    prefixCache=prefixCache,
+                    mixedAdapters=len(self.adapters) > 1
+                )
+        return self.engine
+
+
+    # Draft model has to use the same tokenizer as the base model.
+    def _loadDraftModel(self, path : str):
+        print(f"Loading draft model from: {path}")
+        quantizeLoad = self.settings.base.bits < 16 and self.device != "cpu"
+        draftModel = AutoModelForCausalLM.from_pretrained(
+            path,
+            load_in_8bit=(quantizeLoad and self.settings.base.bits == 8),
+            torch_dtype=self.dtype
         )
+        if not quantizeLoad:
+            draftModel = draftModel.to(self.device)
+        if self.quantizeDynamic:
+            draftModel = quantizeDynamic(draftModel)
+        return draftModel.eval()
 
-        with no_grad():
-            thread = Thread(target=self.model.generate, kwargs=kwargs)
-            thread.start()
-            for text in streamer:
-                if eosPattern:
-                    yield eosPattern.sub('', text)
-                else:
-                    yield text
-            thread.join()
+
+    # Share of draft tokens accepted by the base model, None without speculative decoding.
+    def acceptanceRate(self) -> float:
+        if isinstance(self.engine, SpeculativeEngine):
+            return self.engine.acceptanceRate
+        return None
 
 
     def lookupEmbeddings(self, input : str) -> tensor:
@@ -235,20 +748,76 @@ class Model:
         return embeddings.view(count, -1)
 
 
+    # Embeddings of the first token of each input, plus number of tokens per input. Inputs without
+    # tokens (empty or whitespace) get a zero vector.
+    def lookupEmbeddingsBatch(self, inputs : List[str]) -> Tuple[tensor, List[int]]:
+        tokenized = self.tokenizer.tokenizer(inputs, add_special_tokens=False)['input_ids']
+        counts = [len(ids) for ids in tokenized]
+        ids = tensor([ids[0] if ids else 0 for ids in tokenized]).to(self.device)
+        with no_grad():
+            embeddings = self.model.get_input_embeddings()(ids)
+            embeddings[tensor([count == 0 for count in counts]).to(self.device)] = 0
+        return embeddings, counts
+
+
+    # Cosine similarity of all rows of embeddings with each other.
+    def similarityMatrix(self, embeddings : tensor) -> tensor:
+        embeddings = embeddings.float()
+        # Zero vectors are similar to nothing.
+        embeddingsn = embeddings / embeddings.norm(dim=1, keepdim=True).clamp(min=1e-12)
+        return mm(embeddingsn, embeddingsn.t())
+
+
+    # Normalized input embeddings of the whole vocabulary. Rebuilt when the adapter changes.
+    def _getEmbeddingIndex(self) -> Tuple[List[str], tensor]:
+        if not self.embeddingIndex or self.embeddingIndex[0] != self.adapterPath:
+            tokenizer = self.tokenizer.tokenizer
+            vocab_size = tokenizer.vocab_size
+
+            ids = arange(vocab_size).to(self.device)
+            tokens = tokenizer.convert_ids_to_tokens(list(range(vocab_size)))
+            with no_grad():
+                embeddings = self.model.get_input_embeddings()(ids)
+                embeddingsn = embeddings / embeddings.norm(dim=1, keepdim=True)
+
+            self.embeddingIndex = (self.adapterPath, tokens, embeddingsn)
+
+        return self.embeddingIndex[1], self.embeddingIndex[2]
+
+
+    # Input embeddings of the whole vocabulary (with adapter applied) written to a memory mapped .npy
+    # file, chunkRows at a time. Returns the tokens of the rows.
+    def exportEmbeddings(self, path : str, chunkRows : int = 4096) -> List[str]:
+        embeddingLayer = self.model.get_input_embeddings()
+        rows = min(len(self.tokenizer.tokenizer), embeddingLayer.weight.shape[0])
+        matrix = numpy.lib.format.open_memmap(path, mode="w+", dtype=numpy.float32, shape=(rows, embeddingLayer.weight.shape[1]))
+        with no_grad():
+            for start in range(0, rows, chunkRows):
+                ids = arange(start, min(start + chunkRows, rows)).to(self.device)
+                matrix[start:start + len(ids)] = embeddingLayer(ids).float().cpu().numpy()
+        matrix.flush()
+        del matrix
+        return self.tokenizer.tokenizer.convert_ids_to_tokens(list(range(rows)))
+
+
     def findSimilarTokens(self, tv : tensor, n : int = 1) -> List[Tuple[str, int]]:
-        tokenizer = self.tokenizer.tokenizer
-        vocab_size = tokenizer.vocab_size
+        return self.findSimilarTokensBatch(tv.unsqueeze(0), n)[0]
 
-        ids = arange(vocab_size).to(self.device)
-        tokens = [tokenizer.convert_ids_to_tokens(id) for id in range(vocab_size)]
-        embeddings = self.model.get_input_embeddings()(ids)
 
-        tvn = tv.to(self.device) / tv.norm()
-        embeddingsn = embeddings / embeddings.norm(dim=1, keepdim=True)
-        similarities = mm(embeddingsn, tvn.unsqueeze(-1)).squeeze(-1)
+    # Top n similar tokens for each row of tvs (shape: queries x embedding size).
+    def findSimilarTokensBatch(self, tvs : tensor, n : int = 1) -> List[List[Tuple[str, int]]]:
+        tokens, embeddingsn = self._getEmbeddingIndex()
 
-        result = list(zip(tokens, similarities.tolist()))
-        return sorted(result, key=lambda e: e[1], reverse=True)[:n]
+        with no_grad():
+            tvs = tvs.to(self.device)
+            tvn = tvs / tvs.norm(dim=1, keepdim=True)
+            similarities = mm(embeddingsn, tvn.t())
+            values, ids = similarities.topk(min(n, len(tokens)), dim=0)
+
+        return [
+            [(tokens[id], value) for id, value in zip(columnIds, columnValues)]
+            for columnIds, columnValues in zip(ids.t().tolist(), values.t().tolist())
+        ]
 
 
     def dumpDetails(self):
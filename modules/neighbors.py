@@ -0,0 +1,48 @@
+import numpy
+import torch
+
+
+# Rows per block, so a query block, a key block, their similarities and the running top k
+# (float32 values, int64 indices) stay within memoryBudget bytes.
+def blockSize(rows : int, dim : int, k : int, memoryBudget : int) -> int:
+    size = rows
+    while size > 1 and 4 * (2 * size * dim + size * size) + 12 * size * (k + size) > memoryBudget:
+        size //= 2
+    return size
+
+
+# k nearest neighbors by cosine similarity of every row of embeddings (array of rows x dim, e.g. a
+# memory mapped .npy) among all other rows. Similarities are computed in blocks of query and key
+# rows, only the running top k per query row is kept. Results are written to ids (rows x k, integer)
+# and scores (rows x k, float), most similar first.
+def nearestNeighbors(embeddings, ids, scores, memoryBudget : int, device : str = "cpu"):
+    rows, dim = embeddings.shape
+    k = ids.shape[1]
+    if k >= rows:
+        raise ValueError(f"Number of neighbors ({k}) has to be smaller than number of rows ({rows}).")
+    size = blockSize(rows, dim, k, memoryBudget)
+
+    def block(start):
+        vectors = torch.from_numpy(numpy.array(embeddings[start:start + size], dtype=numpy.float32)).to(device)
+        return vectors / vectors.norm(dim=1, keepdim=True).clamp(min=1e-12)
+
+    for queryStart in range(0, rows, size):
+        queries = block(queryStart)
+        count = queries.shape[0]
+        bestScores = torch.full((count, k), float("-inf"), device=device)
+        bestIds = torch.zeros((count, k), dtype=torch.long, device=device)
+
+        for keyStart in range(0, rows, size):
+            keys = queries if keyStart == queryStart else block(keyStart)
+            similarities = queries @ keys.t()
+            # A row is not its own neighbor.
+            overlap = torch.arange(count, device=device) + queryStart - keyStart
+            valid = (overlap >= 0) & (overlap < keys.shape[0])
+            similarities[valid.nonzero().squeeze(1), overlap[valid]] = float("-inf")
+
+            candidateIds = torch.arange(keyStart, keyStart + keys.shape[0], device=device).expand(count, -1)
+            bestScores, positions = torch.cat([bestScores, similarities], dim=1).topk(k, dim=1)
+            bestIds = torch.cat([bestIds, candidateIds], dim=1).gather(1, positions)
+
+        ids[queryStart:queryStart + count] = bestIds.cpu().numpy()
+        scores[queryStart:queryStart + count] = bestScores.cpu().numpy()
@@ -0,0 +1,109 @@
+from typing import Dict, List
+
+import torch
+from transformers import default_data_collator
+
+
+# Model types whose eager and SDPA attention accept a custom 4D attention mask.
+blockMaskModelTypes = {
+    "llama", "mistral", "mixtral", "gemma", "gemma2", "qwen2", "qwen2_moe", "phi", "phi3", "cohere",
+    "olmo", "stablelm", "starcoder2", "nemotron", "dbrx", "jetmoe", "persimmon"
+}
+
+
+# Packs tokenized samples into blocks of exactly cutoff tokens. Samples are never split,
+# each one ends with EOS. Position ids restart for every sample and the first token of a
+# sample is not used as label, so no sample is trained to continue the previous one.
+# The remainder of a block that cannot hold the next sample is padding.
+class SequencePacker:
+    def __init__(self, cutoff : int, eosTokenId : int, padTokenId : int = 0):
+        self.cutoff = cutoff
+        self.eosTokenId = eosTokenId
+        self.padTokenId = padTokenId
+
+
+    def pack(self, data) -> Dict[str, List[List[int]]]:
+        result = { "input_ids" : [], "attention_mask" : [], "labels" : [], "position_ids" : [] }
+        block = self._newBlock()
+
+        for ids in data["input_ids"]:
+            if not ids:
+                continue
+            if self.eosTokenId is not None and ids[-1] != self.eosTokenId:
+                ids = ids[:self.cutoff - 1] + [self.eosTokenId]
+
+            if len(block["input_ids"]) + len(ids) > self.cutoff:
+                self._finishBlock(block, result)
+                block = self._newBlock()
+
+            block["input_ids"].extend(ids)
+            block["attention_mask"].extend([1] * len(ids))
+            block["labels"].extend([-100] + ids[1:])
+            block["position_ids"].extend(range(len(ids)))
+
+        if block["input_ids"]:
+            self._finishBlock(block, result)
+        return result
+
+
+    def _newBlock(self):
+        return { "input_ids" : [], "attention_mask" : [], "labels" : [], "position_ids" : [] }
+
+
+    def _finishBlock(self, block, result):
+        missing = self.cutoff - len(block["input_ids"])
+        block["input_ids"].extend([self.padTokenId] * missing)
+        block["attention_mask"].extend([0] * missing)
+        block["labels"].extend([-100] * missing)
+        block["position_ids"].extend([0] * missing)
+        for key, values in block.items():
+            result[key].append(values)
+
+
+# Share of padding tokens in a data set of fixed length blocks.
+def paddingRatio(dataSet, cutoff : int) -> float:
+    real = 0
+    total = 0
+    for batch in dataSet.iter(batch_size=1000):
+        real += sum(sum(mask) for mask in batch["attention_mask"])
+        total += len(batch["attention_mask"]) * cutoff
+    return 1 - real / total if total else 0
+
+
+# Packed samples must not attend to each other. Flash attention 2 separates them by their restarting
+# position ids, if no attention mask is given. Other attention implementations need a block diagonal
+# mask. Returns whether flash attention is used, raises if the model supports neither.
+def usesFlashAttention(config) -> bool:
+    if getattr(config, "_attn_implementation", None) == "flash_attention_2":
+        return True
+    if config.model_type in blockMaskModelTypes:
+        return False
+    raise ValueError(f"Packing is not supported for {config.model_type} models with {config._attn_implementation} attention."
+                     " Use flash_attention_2 or disable \"packing\".")
+
+
+# Collates packed blocks, with a block diagonal causal mask or none for flash attention.
+class PackedCollator:
+    def __init__(self, dtype : torch.dtype, flashAttention : bool = False):
+        self.dtype = dtype
+        self.flashAttention = flashAttention
+
+
+    def __call__(self, features):
+        batch = default_data_collator(features)
+        del batch["attention_mask"]
+        if not self.flashAttention:
+            batch["attention_mask"] = blockDiagonalMask(batch["position_ids"], self.dtype)
+        return batch
+
+
+# Tokens attend to earlier tokens of the same sample, samples start at position 0. Padding has
+# position 0 throughout, each padding token only attends to itself. Given in the inverted form
+# transformers expects for 4D masks: batch x 1 x query x key, 0 where allowed, dtype minimum elsewhere.
+def blockDiagonalMask(positionIds : torch.Tensor, dtype : torch.dtype) -> torch.Tensor:
+    samples = (positionIds == 0).cumsum(dim=1)
+    length = positionIds.shape[1]
+    causal = torch.ones(length, length, dtype=torch.bool, device=positionIds.device).tril()
+    allowed = (samples[:, :, None] == samples[:, None, :]) & causal
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=positionIds.device)
+    return mask.masked_fill(~allowed, torch.finfo(dtype).min)[:, None]
@@ -0,0 +1,76 @@
+from collections import OrderedDict, deque
+from typing import Sequence, Tuple
+
+
+# Caches past_key_values (legacy tuple format) of prompt prefixes.
+# Prefixes are discovered by comparing new prompts against recently seen ones: the longest
+# common prefix (e.g. a template preamble) gets stored. Least recently used entries are evicted
+# once the memory budget is exceeded.
+class PrefixCache:
+    def __init__(self, memoryBudget : int, minLength : int = 16, historySize : int = 32):
+        self.memoryBudget = memoryBudget
+        self.minLength = minLength
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.used = 0
+        self.history = deque(maxlen=historySize)
+
+
+    def lookup(self, adapter : str, ids : Sequence[int]) -> Tuple[int, tuple]:
+        best = None
+        for key in self.entries:
+            keyAdapter, prefix = key
+            # At least one token has to remain to produce logits for the next token.
+            if keyAdapter != adapter or len(prefix) >= len(ids):
+                continue
+            if best and len(prefix) <= len(best[1]):
+                continue
+            if tuple(ids[:len(prefix)]) == prefix:
+                best = key
+
+        if not best:
+            return 0, None
+        self.entries.move_to_end(best)
+        return len(best[1]), self.entries[best]
+
+
+    def store(self, adapter : str, ids : Sequence[int], past : tuple):
+        ids = tuple(ids)
+        length = max((_commonPrefixLength(ids, seen) for seenAdapter, seen in self.history if seenAdapter == adapter), default=0)
+        length = min(length, len(ids) - 1)
+        self.history.append((adapter, ids))
+        if length < self.minLength:
+            return
+
+        key = (adapter, ids[:length])
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+
+        prefixPast = tuple(tuple(t[..., :length, :].clone() for t in layer) for layer in past)
+        size = sum(t.nbytes for layer in prefixPast for t in layer)
+        if size > self.memoryBudget:
+            return
+
+        self.entries[key] = prefixPast
+        self.sizes[key] = size
+        self.used += size
+        while self.used > self.memoryBudget:
+            evicted, _ = self.entries.popitem(last=False)
+            self.used -= self.sizes.pop(evicted)
+
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.used = 0
+        self.history.clear()
+
+
+def _commonPrefixLength(a : Sequence[int], b : Sequence[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
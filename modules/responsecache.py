@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List
+
+
+# Caches generated responses by exact request (key()). Responses are stored as the streamed
+# text chunks, so a hit replays like a generation. Entries expire after ttl seconds, least
+# recently used ones are evicted beyond maxEntries. With a path, entries are also written to
+# disk, one file per key, and survive restarts. Used from several server threads at once.
+class ResponseCache:
+    def __init__(self, maxEntries : int, ttl : float = None, path : str = None, diskEntries : int = 10000, clock=time.time):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.path = path
+        self.diskEntries = diskEntries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Files on disk, counted once and then kept up to date. Other processes sharing the
+        # directory aren't seen until the next pruning.
+        self.diskCount = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self.diskCount = len(self._diskFiles())
+
+
+    # Fingerprint identifies the weights (base model, adapter, precision), input is the templated prompt.
+    @staticmethod
+    def key(fingerprint : str, input : str, limit : int, temp : float, top_p : float, top_k : int) -> str:
+        request = json.dumps([fingerprint, input, int(limit), float(temp), float(top_p), int(top_k)])
+        return hashlib.sha256(request.encode()).hexdigest()
+
+
+    def lookup(self, key : str) -> List[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and self._expired(entry[0]):
+                del self.entries[key]
+                entry = None
+            if entry:
+                self.entries.move_to_end(key)
+            else:
+                entry = self._readDisk(key)
+                if entry:
+                    self._storeMemory(key, entry)
+
+            if entry:
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+            return None
+
+
+    def store(self, key : str, chunks : List[str]):
+        entry = (self.clock(), list(chunks))
+        with self.lock:
+            self._storeMemory(key, entry)
+            self._writeDisk(key, entry)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            for fileName in self._diskFiles():
+                _removeFile(os.path.join(self.path, fileName))
+            self.diskCount = 0
+
+
+    def _expired(self, created : float) -> bool:
+        return self.ttl is not None and self.clock() - created > self.ttl
+
+
+    def _storeMemory(self, key : str, entry : tuple):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+
+    def _readDisk(self, key : str) -> tuple:
+        if not self.path:
+            return None
+        filePath = os.path.join(self.path, key + ".json")
+        try:
+            with open(filePath, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if self._expired(data["created"]):
+            _removeFile(filePath)
+            self.diskCount = max(0, self.diskCount - 1)
+            return None
+        return data["created"], data["chunks"]
+
+
+    # Written to a temporary file first, readers never see partial entries. Beyond diskEntries,
+    # the oldest tenth is removed, so pruning doesn't happen on every store.
+    def _writeDisk(self, key : str, entry : tuple):
+        if not self.path:
+            return
+        filePath = os.path.join(self.path, key + ".json")
+        tmpPath = f"{filePath}.{threading.get_ident()}.tmp"
+        if not os.path.exists(filePath):
+            self.diskCount += 1
+        with open(tmpPath, 'w') as file:
+            json.dump({ "created" : entry[0], "chunks" : entry[1] }, file)
+        os.replace(tmpPath, filePath)
+
+        if self.diskCount > self.diskEntries:
+            paths = sorted((os.path.join(self.path, f) for f in self._diskFiles()), key=_modificationTime)
+            removed = paths[:len(paths) - self.diskEntries + self.diskEntries // 10]
+            for old in removed:
+                _removeFile(old)
+            self.diskCount = len(paths) - len(removed)
+
+
+    def _diskFiles(self) -> List[str]:
+        if not self.path:
+            return []
+        return [f for f in os.listdir(self.path) if f.endswith(".json")]
+
+
+# Other processes may share the directory and remove files at the same time.
+def _removeFile(path : str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _modificationTime(path : str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
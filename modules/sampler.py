@@ -0,0 +1,69 @@
+from typing import Iterator, List
+
+import torch
+
+
+# Batches of similar length samples, filled up to a budget of padded tokens (batch size times
+# longest sample, padded to a multiple of lengthMultiple). Samples longer than the budget get a
+# batch of their own. On every pass, batches are re-drawn: samples of the same padded length are
+# shuffled before filling, so the number and sizes of batches stay the same, their composition
+# changes. The order of batches is shuffled as well.
+# With several processes, each one gets every processes-th batch of the shuffled order. All get
+# the same number of batches, the last ones wrap around to the start of the order if needed.
+class TokenBudgetBatchSampler:
+    def __init__(self, lengths : List[int], tokensPerBatch : int, seed : int = 42, rank : int = 0, processes : int = 1,
+                 lengthMultiple : int = 1):
+        self.seed = seed
+        self.epoch = 0
+        self.rank = rank
+        self.processes = processes
+        self.tokensPerBatch = tokensPerBatch
+        self.lengths = [-(-length // lengthMultiple) * lengthMultiple for length in lengths]
+        self.batches = self._fill(sorted(range(len(lengths)), key=lambda i: self.lengths[i]))
+        self.sampleCount = len(lengths)
+
+
+    def __len__(self) -> int:
+        return -(-len(self.batches) // self.processes)
+
+
+    def __iter__(self) -> Iterator[List[int]]:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        noise = torch.rand(len(self.lengths), generator=generator).tolist()
+        self.batches = self._fill(sorted(range(len(self.lengths)), key=lambda i: (self.lengths[i], noise[i])))
+        order = torch.randperm(len(self.batches), generator=generator).tolist()
+        total = len(self) * self.processes
+        order = (order * -(-total // len(order)))[:total] if order else []
+        for i in order[self.rank::self.processes]:
+            yield self.batches[i]
+
+
+    # Samples in ascending length order into batches within the token budget.
+    def _fill(self, indices : List[int]) -> List[List[int]]:
+        batches = []
+        batch, longest = [], 0
+        for index in indices:
+            length = max(longest, self.lengths[index])
+            if batch and (len(batch) + 1) * length > self.tokensPerBatch:
+                batches.append(batch)
+                batch, length = [], self.lengths[index]
+            batch.append(index)
+            longest = length
+        if batch:
+            batches.append(batch)
+        return batches
+
+
+    def set_epoch(self, epoch : int):
+        self.epoch = epoch
+
+
+    # Accumulation steps that keep the number of samples per optimizer step close to the
+    # one of fixed size batches.
+    def accumulationSteps(self, samplesPerStep : int) -> int:
+        if not self.batches:
+            return 1
+        samplesPerBatch = self.sampleCount / len(self.batches)
+        return max(1, round(samplesPerStep / samplesPerBatch))
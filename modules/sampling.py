@@ -0,0 +1,35 @@
+import torch
+from torch.nn.functional import softmax
+
+
+def warpLogits(logits : torch.Tensor, temp : float, top_p : float, top_k : int) -> torch.Tensor:
+    logits = logits / temp
+    vocabSize = logits.shape[-1]
+
+    top_k = int(top_k)
+    if 0 < top_k < vocabSize:
+        kth = torch.topk(logits, top_k, dim=-1).values[..., -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+
+    if top_p < 1:
+        sortedLogits, indices = torch.sort(logits, dim=-1, descending=True)
+        probs = softmax(sortedLogits, dim=-1)
+        # Always keeps the most likely token, as the mass before it is 0.
+        remove = (probs.cumsum(dim=-1) - probs) > top_p
+        sortedLogits = sortedLogits.masked_fill(remove, float("-inf"))
+        logits = torch.full_like(logits, float("-inf")).scatter(-1, indices, sortedLogits)
+
+    return logits
+
+
+def tokenProbabilities(logits : torch.Tensor, temp : float, top_p : float, top_k : int) -> torch.Tensor:
+    return softmax(warpLogits(logits.float(), temp, top_p, top_k), dim=-1)
+
+
+# Temperature 0 (or below) means greedy decoding.
+def sampleToken(logits : torch.Tensor, temp : float, top_p : float, top_k : int) -> torch.Tensor:
+    if temp <= 0:
+        return logits.argmax(dim=-1)
+
+    probs = tokenProbabilities(logits, temp, top_p, top_k)
+    return torch.multinomial(probs, 1).squeeze(-1)
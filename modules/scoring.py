@@ -0,0 +1,21 @@
+import math
+from typing import Tuple
+
+import torch
+from torch.nn.functional import cross_entropy
+
+
+# Label of tokens that are not scored (prompt, padding), same as in training.
+ignoreIndex = -100
+
+
+# Sum of log-probabilities of the labels of each row and number of scored labels. Logits at
+# position i predict label i + 1.
+def sequenceLogLikelihoods(logits : torch.Tensor, labels : torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    labels = labels[:, 1:]
+    losses = cross_entropy(logits[:, :-1].float().transpose(1, 2), labels, ignore_index=ignoreIndex, reduction="none")
+    return -losses.sum(dim=1), (labels != ignoreIndex).sum(dim=1)
+
+
+def perplexity(logLikelihood : float, tokenCount : int) -> float:
+    return math.exp(-logLikelihood / tokenCount) if tokenCount else float("nan")
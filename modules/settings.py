@@ -7,6 +7,10 @@ from typing import Optional
 class BaseSettings:
     path : str
     bits : int = 8
+    device : str = None
+    dtype : str = None
+    threads : int = None
+    interopThreads : int = None
 
 
 @dataclass
@@ -32,10 +36,24 @@ class TrainingSettings:
     batchSize : int = 4
     accumulationSteps : int = 32
     groupByLength : bool = False
+    tokensPerBatch : int = None
+    gradientCheckpointing : bool = False
+    autoTune : bool = False
+    autoTuneMemory : float = 0.9
+    autoTuneLengthPercentile : float = 95
+    packing : bool = False
     warmupSteps : int = 100
     checkpointSteps : int = 100
     checkpointLimit : int = 5
+    asyncCheckpoints : bool = False
     loggingSteps : int = 10
+    dataCache : bool = True
+    dataWorkers : int = 4
+    streaming : bool = False
+    shuffleBuffer : int = 10000
+    seed : int = 42
+    maxSteps : int = None
+    telemetry : bool = True
 
 
 @dataclass
@@ -46,6 +64,17 @@ class InferenceSettings:
     temperature : float = 0.1
     top_p : float = 0.75
     top_k : float = 40
+    maxBatchSize : int = 8
+    maxConcurrency : int = 16
+    prefixCacheSize : int = 256
+    prefixMinLength : int = 16
+    adapters : dict = None
+    draftPath : str = None
+    draftTokens : int = 4
+    responseCacheEntries : int = 0
+    responseCacheTTL : float = 3600
+    responseCachePath : str = None
+    responseCacheMaxTemp : float = 0.1
 
 
 @dataclass
@@ -54,6 +83,17 @@ class UiSettings:
     inputFields : str = "input"
 
 
+# Data parallel training: processes per node, all nodes reach the node with rank 0 on masterAddr:masterPort.
+@dataclass
+class DistributedSettings:
+    processes : int = 1
+    nodes : int = 1
+    nodeRank : int = 0
+    masterAddr : str = "127.0.0.1"
+    masterPort : int = 29500
+    backend : str = "gloo"
+
+
 @dataclass
 class Settings:
     base : BaseSettings
@@ -61,6 +101,7 @@ class Settings:
     training : TrainingSettings
     inference : InferenceSettings
     ui : UiSettings
+    distributed : DistributedSettings
     templatePath : str = None
 
 
@@ -73,6 +114,7 @@ class Settings:
         self.training = TrainingSettings(**json_dict.get('training', {}))
         self.inference = InferenceSettings(**json_dict.get('inference', {}))
         self.ui = UiSettings(**json_dict.get('ui', {}))
+        self.distributed = DistributedSettings(**json_dict.get('distributed', {}))
 
         self.templatePath = json_dict.get('templatePath', self.templatePath)
         if not self.inference.templatePath:
@@ -102,5 +144,6 @@ class Settings:
         print(f"Training: {vars(self.training)}")
         print(f"Inference: {vars(self.inference)}")
         print(f"UI: {vars(self.ui)}")
+        print(f"Distributed: {vars(self.distributed)}")
         print(f"templatePath: {self.templatePath}")
         print("=====================================")
@@ -0,0 +1,163 @@
+from typing import List
+
+import torch
+
+from .engine import GenerationEngine, GenerationRequest
+from .sampling import sampleToken, tokenProbabilities
+
+
+# Speculative decoding: a small draft model proposes several tokens, the target model verifies all of
+# them in one forward pass. Proposals are accepted by rejection sampling against the target distribution,
+# so output follows the same distribution as plain sampling (identical output for greedy decoding).
+# Requests are processed one at a time, as this optimizes latency of single requests.
+class SpeculativeEngine(GenerationEngine):
+    def __init__(self, model, draftModel, eosTokenId : int, draftTokens : int = 4, mixedAdapters : bool = False):
+        super().__init__(model, eosTokenId, maxBatchSize=1, mixedAdapters=mixedAdapters)
+        self.draftModel = draftModel
+        self.draftTokens = draftTokens
+        self.draftCacheClass = None
+        # Draft and target may pad their vocabularies differently.
+        self.vocabSize = min(model.config.vocab_size, draftModel.config.vocab_size)
+
+        self.proposed = 0
+        self.accepted = 0
+
+
+    @property
+    def acceptanceRate(self) -> float:
+        if not self.proposed:
+            return None
+        return self.accepted / self.proposed
+
+
+    def _run(self):
+        with torch.no_grad():
+            while True:
+                request = self.pending.get()
+                if request is None:
+                    return
+                if request.cancelled.is_set():
+                    request.finish()
+                    continue
+                try:
+                    self._generate(request)
+                except Exception as e:
+                    if not request.done.is_set():
+                        request.finish(e)
+
+
+    def _generate(self, request : GenerationRequest):
+        inputIds = request.inputIds
+        output = self.model(input_ids=inputIds, use_cache=True, **self._adapterArgs([request]))
+        targetPast = self._toLegacy(output.past_key_values)
+        draftPast = None
+
+        token = self._sample(output.logits[:, -1, :self.vocabSize], [request])[0]
+        if self._emit(request, token):
+            return
+
+        # Target cache covers all of sequence except its last token. Draft cache may lag behind,
+        # missing tokens are fed on the next proposal.
+        sequence = torch.cat([inputIds[0], token.view(1)])
+        while True:
+            count = min(self.draftTokens, request.limit - request.generated - 1)
+            proposals, draftProbs, draftPast = self._propose(request, sequence, draftPast, count)
+            tokens, targetPast = self._verify(request, sequence, targetPast, proposals, draftProbs)
+
+            self.proposed += len(proposals)
+            self.accepted += len(tokens) - 1
+
+            for token in tokens:
+                if self._emit(request, token):
+                    return
+
+            sequence = torch.cat([sequence, torch.stack(tokens)])
+            draftPast = _crop(draftPast, sequence.shape[0] - 1)
+
+
+    def _propose(self, request : GenerationRequest, sequence : torch.Tensor, draftPast, count : int):
+        proposals, draftProbs = [], []
+        input = sequence[_length(draftPast):].unsqueeze(0)
+
+        for _ in range(count):
+            output = self.draftModel(
+                input_ids=input,
+                past_key_values=self._draftFromLegacy(draftPast) if draftPast else None,
+                use_cache=True
+            )
+            draftPast = self._draftToLegacy(output.past_key_values)
+
+            logits = output.logits[0, -1, :self.vocabSize]
+            if request.temp <= 0:
+                token = logits.argmax(dim=-1)
+            else:
+                probs = tokenProbabilities(logits, request.temp, request.top_p, request.top_k)
+                token = torch.multinomial(probs, 1)[0]
+                draftProbs.append(probs)
+
+            proposals.append(token)
+            input = token.view(1, 1)
+
+        return proposals, draftProbs, draftPast
+
+
+    # Returns accepted proposals followed by one token sampled from the target model, and the
+    # target cache trimmed to the accepted part.
+    def _verify(self, request : GenerationRequest, sequence : torch.Tensor, targetPast, proposals : List[torch.Tensor], draftProbs : List[torch.Tensor]):
+        input = torch.stack([sequence[-1], *proposals]).unsqueeze(0)
+        output = self.model(
+            input_ids=input,
+            past_key_values=self._fromLegacy(targetPast),
+            use_cache=True,
+            **self._adapterArgs([request])
+        )
+        logits = output.logits[0, :, :self.vocabSize]
+
+        accepted, correction = 0, None
+        for i, token in enumerate(proposals):
+            if request.temp <= 0:
+                if logits[i].argmax(dim=-1) != token:
+                    break
+            else:
+                # Accepts with probability min(1, p / q), on rejection samples from the residual distribution.
+                targetProbs = tokenProbabilities(logits[i], request.temp, request.top_p, request.top_k)
+                if torch.rand((), device=token.device) * draftProbs[i][token] > targetProbs[token]:
+                    correction = _sampleResidual(targetProbs, draftProbs[i])
+                    break
+            accepted += 1
+
+        if correction is None:
+            correction = sampleToken(logits[accepted], request.temp, request.top_p, request.top_k)
+
+        targetPast = _crop(self._toLegacy(output.past_key_values), sequence.shape[0] + accepted)
+        return proposals[:accepted] + [correction], targetPast
+
+
+    def _draftToLegacy(self, past):
+        if hasattr(past, "to_legacy_cache"):
+            self.draftCacheClass = type(past)
+            return past.to_legacy_cache()
+        return past
+
+
+    def _draftFromLegacy(self, past):
+        if self.draftCacheClass:
+            return self.draftCacheClass.from_legacy_cache(past)
+        return past
+
+
+def _sampleResidual(targetProbs : torch.Tensor, draftProbs : torch.Tensor) -> torch.Tensor:
+    residual = (targetProbs - draftProbs).clamp(min=0)
+    if residual.sum() <= 0:
+        residual = targetProbs
+    return torch.multinomial(residual, 1)[0]
+
+
+def _length(past) -> int:
+    return past[0][0].shape[-2] if past else 0
+
+
+def _crop(past, length : int):
+    if not past:
+        return past
+    return tuple(tuple(t[..., :length, :] for t in layer) for layer in past)
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import resource
+
+import torch
+from transformers import TrainerCallback
+
+from .distributed import sumAcrossProcesses
+
+
+telemetryFileName = "telemetry.jsonl"
+
+
+# Records per optimizer step: wall time, time spent waiting for data, real (unpadded) and
+# padded token counts and peak memory. Checkpoint saves are recorded separately.
+# Batches are reported by ModelTrainer (batchStart/batchEnd), callbacks can't see them.
+# Times are taken on the host, with CUDA they even out over steps rather than being exact per step.
+# Values chosen by auto tuning, if given, are the first record of the run.
+class TrainingTelemetry(TrainerCallback):
+    def __init__(self, outputPath : str, tuning : dict = None):
+        self.path = os.path.join(outputPath, telemetryFileName)
+        self.tuning = tuning
+        self.file = None
+        self.totals = { "steps" : 0, "time" : 0.0, "dataWait" : 0.0, "compute" : 0.0, "tokens" : 0, "paddedTokens" : 0, "saveTime" : 0.0, "saves" : 0 }
+        self.peakMemory = 0
+        self._resetStep()
+        self.mark = time.perf_counter()
+
+
+    def _resetStep(self):
+        self.stepStart = None
+        self.dataWait = 0.0
+        self.compute = 0.0
+        self.tokens = 0
+        self.paddedTokens = 0
+
+
+    # Marks end of host work (compute, logging, saving). Time until the next batch arrives is data loading.
+    def _mark(self):
+        self.mark = time.perf_counter()
+
+
+    def batchStart(self, inputs):
+        now = time.perf_counter()
+        if self.stepStart is None:
+            self.stepStart = self.mark
+        self.dataWait += now - self.mark
+        self.batchStartTime = now
+
+        inputIds = inputs["input_ids"]
+        mask = inputs.get("attention_mask")
+        self.paddedTokens += inputIds.numel()
+        if mask is not None and mask.dim() == 2:
+            self.tokens += int(mask.sum())
+        elif "position_ids" in inputs:
+            self.tokens += _packedTokens(inputs["position_ids"])
+        else:
+            self.tokens += inputIds.numel()
+
+
+    def batchEnd(self):
+        self._mark()
+        self.compute += self.mark - self.batchStartTime
+
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        if state.is_world_process_zero:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'a')
+            if self.tuning:
+                self._write({ "autoTune" : self.tuning })
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._mark()
+
+
+    # With several processes, token counts are totals of all of them. Times and memory are the
+    # ones of the main process.
+    def on_step_end(self, args, state, control, **kwargs):
+        self.tokens, self.paddedTokens = (int(n) for n in sumAcrossProcesses([self.tokens, self.paddedTokens]))
+        now = time.perf_counter()
+        # optimizer step since the last batch counts as compute
+        self.compute += now - self.mark
+        stepTime = now - (self.stepStart if self.stepStart is not None else self.mark)
+        peakMemory = _peakMemory()
+        self.peakMemory = max(self.peakMemory, peakMemory)
+
+        self._write({
+            "step" : state.global_step,
+            "time" : stepTime,
+            "dataWait" : self.dataWait,
+            "compute" : self.compute,
+            "tokens" : self.tokens,
+            "paddedTokens" : self.paddedTokens,
+            "tokensPerSecond" : self.tokens / stepTime if stepTime else None,
+            "paddedTokensPerSecond" : self.paddedTokens / stepTime if stepTime else None,
+            "paddingRatio" : 1 - self.tokens / self.paddedTokens if self.paddedTokens else 0,
+            "peakMemory" : peakMemory
+        })
+
+        totals = self.totals
+        totals["steps"] += 1
+        totals["time"] += stepTime
+        totals["dataWait"] += self.dataWait
+        totals["compute"] += self.compute
+        totals["tokens"] += self.tokens
+        totals["paddedTokens"] += self.paddedTokens
+        self._resetStep()
+        self._mark()
+
+
+    def on_log(self, args, state, control, **kwargs):
+        self._mark()
+
+
+    # Called right after the checkpoint got written, which started at the end of the step.
+    def on_save(self, args, state, control, **kwargs):
+        saveTime = time.perf_counter() - self.mark
+        self.totals["saveTime"] += saveTime
+        self.totals["saves"] += 1
+        self._write({ "step" : state.global_step, "checkpointSaveTime" : saveTime })
+        self._mark()
+
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if state.is_world_process_zero:
+            self.printSummary()
+
+
+    def printSummary(self):
+        t = self.totals
+        if not t["steps"]:
+            return
+        total = t["time"] + t["saveTime"]
+        print("=== Training telemetry ===")
+        print(f"Steps: {t['steps']}  Time: {total:.1f}s  Mean step time: {t['time'] / t['steps']:.3f}s")
+        print(f"Tokens/sec: {t['tokens'] / t['time']:.1f} real, {t['paddedTokens'] / t['time']:.1f} padded"
+              f"  Padding ratio: {1 - t['tokens'] / t['paddedTokens'] if t['paddedTokens'] else 0:.1%}")
+        print(f"Time share: compute {t['compute'] / total:.1%}, data wait {t['dataWait'] / total:.1%},"
+              f" checkpoint saving {t['saveTime'] / total:.1%} ({t['saves']} saves)")
+        print(f"Peak memory: {self.peakMemory / 1024**2:.1f} MB")
+        print(f"Details: {self.path}")
+
+
+    def _write(self, record):
+        if self.file:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+
+# GPU memory if training on CUDA, otherwise peak resident memory of the process.
+def _peakMemory() -> int:
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Packed blocks carry no padding mask. Padding fills the end of a block at position 0, samples
+# (of more than one token) end at a later position.
+def _packedTokens(positionIds : torch.Tensor) -> int:
+    used = positionIds != 0
+    lengths = positionIds.shape[1] - used.flip(dims=[1]).int().argmax(dim=1)
+    return int((lengths * used.any(dim=1)).sum())
@@ -1,13 +1,17 @@
 import re
 import json
+from string import Formatter
+from typing import Dict, List
 
 class Template:
     def __init__(self, templatePath = None):
         if templatePath:
             with open(templatePath, 'r') as file:
                 self.templates = self._createTemplateMap(json.load(file))
+            self.formatters = { key : _Formatter(template) for key, template in self.templates.items() }
         else:
             self.templates = None
+            self.formatters = None
 
 
     def _createTemplateMap(self, data):
@@ -34,5 +38,53 @@ class Template:
             return template.format(**format_args)
 
 
+    # Same as apply() for a columnar batch (field -> list of values). Rows are grouped by the
+    # fields they have set, every group is formatted in one pass.
+    def applyBatch(self, batch : Dict[str, List]) -> List[str]:
+        columns = list(batch)
+        if not columns:
+            return []
+
+        groups = {}
+        for row, values in enumerate(zip(*(batch[c] for c in columns))):
+            signature = tuple(c for c, v in zip(columns, values) if v or c == "output")
+            groups.setdefault(signature, []).append(row)
+
+        result = [None] * len(batch[columns[0]])
+        for signature, rows in groups.items():
+            if not self.formatters:
+                texts = (''.join(batch[c][row] for c in signature) for row in rows)
+            else:
+                formatter = self.formatters[','.join(sorted(signature))]
+                texts = formatter.formatColumns([[batch[f][row] for row in rows] for f in formatter.fields], len(rows))
+
+            for row, text in zip(rows, texts):
+                result[row] = text
+
+        return result
+
+
     def hasTemplate(self):
         return self.templates != None
+
+
+# Template compiled to positional str.format, which avoids building keyword dicts per row.
+class _Formatter:
+    def __init__(self, template : str):
+        self.fields = []
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is not None:
+                if field not in self.fields:
+                    self.fields.append(field)
+                conversion = f"!{conversion}" if conversion else ""
+                spec = f":{spec}" if spec else ""
+                parts.append(f"{{{self.fields.index(field)}{conversion}{spec}}}")
+        self.format = ''.join(parts).format
+
+
+    def formatColumns(self, columns : List[List], count : int) -> List[str]:
+        if not columns:
+            return [self.format()] * count
+        return list(map(self.format, *columns))
@@ -0,0 +1,119 @@
+import os
+import shutil
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import Trainer
+from transformers.trainer import OPTIMIZER_NAME, SCHEDULER_NAME, TRAINER_STATE_NAME, TRAINING_ARGS_NAME
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+from .telemetry import TrainingTelemetry
+from .checkpoint import CheckpointWriter, listCheckpoints
+from .sampler import TokenBudgetBatchSampler
+
+
+# Trainer reporting batches to telemetry, if given. With asyncCheckpoints, checkpoints are
+# snapshotted to CPU memory and written by a background thread while training continues.
+# A batch sampler replaces fixed size batches.
+class ModelTrainer(Trainer):
+    def __init__(self, *args, telemetry : TrainingTelemetry = None, asyncCheckpoints : bool = False,
+                 batchSampler : TokenBudgetBatchSampler = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.telemetry = telemetry
+        if telemetry:
+            self.add_callback(telemetry)
+        self.checkpointWriter = CheckpointWriter() if asyncCheckpoints else None
+        self.batchSampler = batchSampler
+
+
+    def get_train_dataloader(self):
+        if not self.batchSampler:
+            return super().get_train_dataloader()
+
+        dataSet = self._remove_unused_columns(self.train_dataset, description="training")
+        dataLoader = DataLoader(
+            dataSet,
+            batch_sampler=self.batchSampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory
+        )
+        # The sampler shards batches between processes itself, accelerate would shard them again.
+        if self.batchSampler.processes > 1:
+            return dataLoader
+        return self.accelerator.prepare(dataLoader)
+
+
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            if self.checkpointWriter:
+                self.checkpointWriter.wait()
+
+
+    # Newer transformers versions pass further arguments, e.g. num_items_in_batch.
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self.telemetry:
+            self.telemetry.batchStart(inputs)
+        loss = super().training_step(model, inputs, *args, **kwargs)
+        if self.telemetry:
+            self.telemetry.batchEnd()
+        return loss
+
+
+    def _save_checkpoint(self, model, trial, metrics=None):
+        if not self.checkpointWriter:
+            return super()._save_checkpoint(model, trial, metrics=metrics)
+
+        self.store_flos()
+        runDir = self._get_output_dir(trial=trial)
+        name = f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}"
+        path = os.path.join(runDir, name)
+        tmpPath = os.path.join(runDir, f"tmp-{name}")
+        if self.args.should_save:
+            shutil.rmtree(tmpPath, ignore_errors=True)
+            os.makedirs(tmpPath)
+
+        # Every process stores its RNG state, the main process completes the checkpoint once all did.
+        self.accelerator.wait_for_everyone()
+        self._save_rng_state(tmpPath)
+        self.accelerator.wait_for_everyone()
+        if not self.args.should_save:
+            return
+
+        # Small state is written right away, weights and optimizer state are copied.
+        self.state.stateful_callbacks["TrainerControl"] = self.control.state()
+        self.state.save_to_json(os.path.join(tmpPath, TRAINER_STATE_NAME))
+        torch.save(self.args, os.path.join(tmpPath, TRAINING_ARGS_NAME))
+
+        trainable = { name for name, p in self.model.named_parameters() if p.requires_grad }
+        weights = _snapshot({ key : t for key, t in self.model.state_dict().items() if key in trainable })
+        optimizerState = _snapshot(self.optimizer.state_dict())
+        schedulerState = _snapshot(self.lr_scheduler.state_dict())
+
+        def write():
+            self.model.save_pretrained(tmpPath, state_dict=weights, safe_serialization=self.args.save_safetensors)
+            torch.save(optimizerState, os.path.join(tmpPath, OPTIMIZER_NAME))
+            torch.save(schedulerState, os.path.join(tmpPath, SCHEDULER_NAME))
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmpPath, path)
+
+            limit = self.args.save_total_limit
+            if limit:
+                for old in listCheckpoints(runDir)[:-limit]:
+                    shutil.rmtree(old, ignore_errors=True)
+
+        self.checkpointWriter.submit(write)
+
+
+# Copies tensors of a (nested) state dict to CPU memory, so training can continue
+# while the copy gets written.
+def _snapshot(state):
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return { key : _snapshot(value) for key, value in state.items() }
+    if isinstance(state, (list, tuple)):
+        return type(state)(_snapshot(value) for value in state)
+    return state
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+import os
+import sys
+import json
+
+from modules.launcher import launch
+from modules.settings import Settings
+from modules.data import DataProcessor
+from modules.model import Model
+from modules.scoring import perplexity
+
+
+outputOnlyOption = "--output-only"
+checkpointOption = "--checkpoint="
+outputOption = "--output="
+
+
+def isWithin(path : str, directory : str) -> bool:
+	if not path:
+		return False
+	directory = os.path.abspath(directory)
+	return os.path.commonpath([os.path.abspath(path), directory]) == directory
+
+
+# Usage: score.py <settingFile> [<data.json>] [--output-only] [--checkpoint=<path>] [--output=<scores.jsonl>]
+# Data defaults to the training data, formatted with the training template. --output-only scores just
+# the output part of the template. --checkpoint scores a checkpoint instead of the latest adapter.
+# Writes { "index", "logLikelihood", "tokens", "perplexity" } per row and prints totals.
+def main(s : str = None, *options):
+	settings = Settings(s)
+	dataPath = settings.training.dataPath
+	outputPath = None
+	outputOnly = False
+	checkpoint = None
+	for option in options:
+		if option == outputOnlyOption:
+			outputOnly = True
+		elif option.startswith(checkpointOption):
+			checkpoint = option[len(checkpointOption):]
+			settings.training.outputPath = checkpoint
+		elif option.startswith(outputOption):
+			outputPath = option[len(outputOption):]
+		else:
+			dataPath = option
+	if not outputPath:
+		outputPath = os.path.splitext(dataPath)[0] + "-scores.jsonl"
+	settings.print()
+
+	if checkpoint and not os.path.isdir(checkpoint):
+		print(f"Checkpoint not found: {checkpoint}")
+		sys.exit(1)
+	model = Model(settings, trainable=False)
+	# Without a loadable adapter in the checkpoint, the model falls back to the configured one.
+	if checkpoint and not isWithin(model.adapterPath, checkpoint):
+		print(f"No loadable adapter in checkpoint: {checkpoint}")
+		sys.exit(1)
+	dp = DataProcessor(settings.training.templatePath)
+	data = dp.loadData(dataPath, randomize=False, withPrompt=outputOnly)
+
+	totalLogLikelihood, totalTokens = 0.0, 0
+	with open(outputPath, 'w') as file:
+		results = model.score(data, batchSize=settings.inference.maxBatchSize, outputOnly=outputOnly)
+		for count, (index, logLikelihood, tokens) in enumerate(results, start=1):
+			file.write(json.dumps({
+				"index" : index,
+				"logLikelihood" : logLikelihood,
+				"tokens" : tokens,
+				"perplexity" : perplexity(logLikelihood, tokens) if tokens else None
+			}) + '\n')
+			file.flush()
+			totalLogLikelihood += logLikelihood
+			totalTokens += tokens
+			if count % 100 == 0:
+				print(f"{count} / {len(data)}")
+
+	print(f"Samples: {len(data)}  Tokens: {totalTokens}  Log-likelihood: {totalLogLikelihood:.2f}  Perplexity: {perplexity(totalLogLikelihood, totalTokens):.3f}")
+	print(f"Scores written to: {outputPath}")
+
+
+if __name__ == "__main__":
+    launch(main)
@@ -4,15 +4,71 @@ import os
 
 from modules.launcher import launch
 from modules.settings import Settings
-from modules.model import Model
+from modules.inspection import readBaseModel, readCheckpoint, findAdapter, moduleTotals, estimateMemory
+from modules.merging import adapterHash, isMergeCurrent, mergedModelPath
 
 
-def main(s : str = None):
+loadOption = "--load"
+
+
+def formatSize(size):
+    return f"{size / 1024**2:10.1f} MB"
+
+
+def dumpTensors(title, tensors):
+    print(f"=== {title} ===")
+    for t in tensors:
+        print(f"{t.name}  Shape: {t.shape}  Type: {t.dtype}  Size: {formatSize(t.size).strip()}")
+    print()
+
+
+def dumpModules(tensors):
+    print("=== Modules ===")
+    for module, (count, params, size) in moduleTotals(tensors).items():
+        print(f"{module:60s} Tensors: {count:5d}  Params: {params:14,d}  Size: {formatSize(size)}")
+    print()
+
+
+def inspect(settings):
+    adapter = None
+    path = findAdapter(settings.training.outputPath) or findAdapter(settings.adapter.path)
+
+    # Same as Model: an up to date merged model replaces base model + adapter
+    mergedPath = mergedModelPath(settings)
+    if path and isMergeCurrent(mergedPath, settings.base.path, adapterHash(path)):
+        base = readBaseModel(mergedPath)
+        dumpTensors(f"Merged: {mergedPath}", base)
+        path = None
+    else:
+        base = readBaseModel(settings.base.path)
+        dumpTensors(f"Base: {settings.base.path}", base)
+    dumpModules(base)
+
+    if path:
+        adapter = readCheckpoint(path, "adapter_model")
+        dumpTensors(f"Adapter: {path}", adapter)
+
+    print("=== Totals ===")
+    print(f"Base params: {sum(t.params for t in base):,d}  Checkpoint size: {formatSize(sum(t.size for t in base)).strip()}")
+    if adapter:
+        print(f"Adapter params: {sum(t.params for t in adapter):,d}  Checkpoint size: {formatSize(sum(t.size for t in adapter)).strip()}")
+    for bits in (4, 8, 16):
+        marker = " (configured)" if bits == settings.base.bits else ""
+        print(f"Estimated base memory at {bits:2d} bits: {formatSize(estimateMemory(base, bits)).strip()}{marker}")
+
+
+# Usage: stats.py <settingFile> [--load]
+# Reads checkpoint headers only. --load instantiates the full model instead.
+def main(s : str = None, option : str = None):
 	settings = Settings(s)
 	settings.print()
 
-	model = Model(settings, trainable=False)
-	model.dumpDetails()
+	if option == loadOption:
+		from modules.model import Model
+		model = Model(settings, trainable=False)
+		model.dumpDetails()
+	else:
+		inspect(settings)
 
 
 if __name__ == "__main__":
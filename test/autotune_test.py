@@ -0,0 +1,67 @@
+import pytest
+
+from modules.autotune import tuneBatchSize, memoryBudget
+
+
+# Memory grows linearly with batch size. Step time has a fixed part, so throughput rises with batch
+# size up to saturation and drops beyond it.
+def makeProbe(perSample=100, fixed=1000, saturation=1024, limit=None):
+    calls = []
+    def probe(batchSize):
+        calls.append(batchSize)
+        if limit and batchSize > limit:
+            return None
+        if batchSize <= saturation:
+            stepTime = 0.01 + 0.001 * batchSize
+        else:
+            stepTime = (0.01 + 0.001 * saturation) * batchSize / saturation * 1.1
+        return stepTime, fixed + batchSize * perSample, fixed
+    return probe, calls
+
+
+def testLargestFittingBatch():
+    probe, calls = makeProbe()
+    batchSize, probes = tuneBatchSize(probe, maxBatchSize=64, memoryBudget=1000 + 100 * 37)
+    assert batchSize == 37
+    assert calls[:6] == [1, 2, 4, 8, 16, 32]
+    assert len(calls) == len(set(calls))
+    # Sizes estimated to exceed the budget aren't probed, but count as not fitting.
+    assert all(1000 + 100 * b <= 1000 + 100 * 37 for b in calls)
+    assert probes[64] is None and probes[38] is None
+
+def testSkipsProbesExceedingBudget():
+    probe, calls = makeProbe(perSample=100, fixed=1000)
+    batchSize, _ = tuneBatchSize(probe, maxBatchSize=64, memoryBudget=1000 + 100 * 5)
+    assert batchSize == 5
+    assert calls == [1, 2, 4, 5]
+
+def testOutOfMemoryProbe():
+    probe, _ = makeProbe(limit=20)
+    assert tuneBatchSize(probe, maxBatchSize=64)[0] == 20
+
+def testLimitedByMaxBatchSize():
+    probe, calls = makeProbe()
+    assert tuneBatchSize(probe, maxBatchSize=12, memoryBudget=10**9)[0] == 12
+    assert calls == [1, 2, 4, 8, 12]
+
+def testStopsWhenThroughputSaturates():
+    probe, calls = makeProbe(saturation=4)
+    batchSize, _ = tuneBatchSize(probe, maxBatchSize=128, memoryBudget=10**9)
+    assert batchSize == 4
+    assert calls == [1, 2, 4, 8]
+
+def testNothingFits():
+    probe, _ = makeProbe()
+    batchSize, probes = tuneBatchSize(probe, maxBatchSize=8, memoryBudget=500)
+    assert batchSize is None
+    assert list(probes) == [1]
+
+def testCpuMemoryBudget():
+    budget = memoryBudget("cpu", 0.5)
+    assert budget is None or budget > 0
+
+def testCpuMemoryBudgetSharedByProcesses():
+    budget = memoryBudget("cpu", 1.0)
+    if budget is None:
+        pytest.skip("No /proc/meminfo")
+    assert memoryBudget("cpu", 1.0, processes=4) < budget
@@ -0,0 +1,26 @@
+import json
+import pytest
+
+from modules.batchfile import readRecords, completedIndices
+
+
+def testReadRecords(tmp_path):
+    assert readRecords("test/resources/data-basic.json")[0] == { "input" : "dp1", "output" : "data point 1" }
+
+    path = tmp_path / "records.jsonl"
+    path.write_text('{"input" : "a"}\n\n{"input" : "b"}\n')
+    assert readRecords(str(path)) == [{ "input" : "a" }, { "input" : "b" }]
+
+def testCompletedIndices(tmp_path):
+    path = tmp_path / "output.jsonl"
+    assert completedIndices(str(path)) == set()
+
+    path.write_text('{"index" : 4, "output" : "x"}\n{"index" : 1, "output" : "y"}\n')
+    assert completedIndices(str(path)) == { 1, 4 }
+
+def testIncompleteLineIsRemoved(tmp_path):
+    path = tmp_path / "output.jsonl"
+    complete = '{"index" : 0, "output" : "x"}\n'
+    path.write_text(complete + '{"index" : 1, "out')
+    assert completedIndices(str(path)) == { 0 }
+    assert path.read_text() == complete
@@ -0,0 +1,34 @@
+import time
+import pytest
+
+from modules.benchmark import Stopwatch, percentile, latencySummary, measureGeneration
+
+
+def testPercentile():
+    assert percentile([], 50) is None
+    assert percentile([3], 99) == 3
+    assert percentile([4, 1, 3, 2], 50) == 2.5
+    assert percentile(list(range(101)), 99) == 99
+    assert percentile([1, 2], 100) == 2
+
+def testLatencySummary():
+    summary = latencySummary([1, 2, 3])
+    assert summary == { "mean" : 2, "p50" : 2, "p99" : pytest.approx(2.98) }
+
+def testStopwatch():
+    with Stopwatch() as watch:
+        time.sleep(0.01)
+    assert watch.seconds >= 0.01
+
+def testMeasureGeneration():
+    count = [0]
+    def generate(prompt):
+        for word in prompt.split():
+            count[0] += 1
+            yield word + " "
+
+    result = measureGeneration(generate, lambda: count[0], ["a b", "c d e", "f"], concurrency=2)
+    assert result["requests"] == 3
+    assert result["tokens"] == 6
+    assert result["tokensPerSecond"] > 0
+    assert result["latency"]["p50"] >= result["timeToFirstToken"]["p50"] >= 0
@@ -0,0 +1,36 @@
+import time
+import pytest
+
+from modules.checkpoint import CheckpointWriter, listCheckpoints, latestCheckpoint
+
+
+def testCheckpointsOrderedByStep(tmp_path):
+    for name in ["checkpoint-100", "checkpoint-20", "checkpoint-3", "tmp-checkpoint-200", "checkpoint-x", "other"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "checkpoint-300").write_text("not a directory")
+
+    assert listCheckpoints(str(tmp_path)) == [str(tmp_path / n) for n in ["checkpoint-3", "checkpoint-20", "checkpoint-100"]]
+    assert latestCheckpoint(str(tmp_path)) == str(tmp_path / "checkpoint-100")
+
+def testNoCheckpoints(tmp_path):
+    assert latestCheckpoint(str(tmp_path)) is None
+    assert latestCheckpoint(str(tmp_path / "missing")) is None
+    assert latestCheckpoint(None) is None
+
+def testWriterRunsJobsInOrder():
+    writer = CheckpointWriter()
+    done = []
+    for i in range(5):
+        writer.submit(lambda i=i: (time.sleep(0.01), done.append(i)))
+    writer.wait()
+    assert done == [0, 1, 2, 3, 4]
+
+def testWriterReportsErrors():
+    writer = CheckpointWriter()
+    def fail():
+        raise OSError("disk full")
+    writer.submit(fail)
+    with pytest.raises(RuntimeError):
+        writer.wait()
+    writer.submit(lambda: None)
+    writer.wait()
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import socket
+import pytest
+from threading import Thread, Event, Lock
+
+from modules.daemon import InferenceServer, DaemonClient, socketPath
+
+
+class FakeModel:
+    def generate(self, input, limit=3, **kwargs):
+        if input == "fail":
+            raise ValueError("broken")
+        for i in range(limit):
+            yield f"{input}{i} "
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    server = InferenceServer(path, FakeModel())
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def testSocketPath():
+    assert socketPath("test/resources/settings.json") == socketPath(os.path.abspath("test/resources/settings.json"))
+    assert socketPath("test/resources/settings.json") != socketPath("test/resources/settings-min.json")
+
+def testNoDaemon(tmp_path):
+    assert DaemonClient.connect(str(tmp_path / "none.sock")) is None
+
+def testStreamedGeneration(server):
+    client = DaemonClient.connect(server)
+    assert list(client.generate("x")) == ["x0 ", "x1 ", "x2 "]
+    assert list(client.generate("y", limit=1)) == ["y0 "]
+
+def testError(server):
+    client = DaemonClient.connect(server)
+    with pytest.raises(RuntimeError) as excinfo:
+        list(client.generate("fail"))
+    assert "broken" in str(excinfo.value)
+
+def testMalformedRequest(server):
+    for line in (b"not json\n", b'{ "limit" : 2 }\n', b'[1]\n'):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(server)
+            with sock.makefile('rwb') as stream:
+                stream.write(line)
+                stream.flush()
+                assert "error" in json.loads(stream.readline())
+
+def testSecondDaemonRefused(server):
+    with pytest.raises(RuntimeError):
+        InferenceServer(server, FakeModel())
+
+def testStaleSocketReplaced(tmp_path):
+    path = str(tmp_path / "stale.sock")
+    open(path, 'w').close()
+    server = InferenceServer(path, FakeModel())
+    assert DaemonClient.connect(path)
+    server.server_close()
+    assert not os.path.exists(path)
+
+def testDisconnectClosesGeneration(tmp_path):
+    closed = Event()
+
+    class EndlessModel:
+        def generate(self, input, **kwargs):
+            try:
+                while True:
+                    yield "x" * 4096
+            finally:
+                closed.set()
+
+    path = str(tmp_path / "endless.sock")
+    server = InferenceServer(path, EndlessModel())
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        results = DaemonClient.connect(path).generate("x")
+        next(results)
+        results.close()
+        assert closed.wait(5)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def testThreadLimit(tmp_path):
+    release = Event()
+    active, peak = [0], [0]
+    lock = Lock()
+
+    class SlowModel:
+        def generate(self, input, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            release.wait(5)
+            with lock:
+                active[0] -= 1
+            yield input
+
+    path = str(tmp_path / "slow.sock")
+    server = InferenceServer(path, SlowModel(), maxThreads=2)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        results = []
+        clients = [Thread(target=lambda i=i: results.append(list(DaemonClient(path).generate(str(i))))) for i in range(4)]
+        for client in clients:
+            client.start()
+        time.sleep(0.5)
+        assert peak[0] == 2
+        release.set()
+        for client in clients:
+            client.join()
+        assert sorted(results) == [["0"], ["1"], ["2"], ["3"]]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
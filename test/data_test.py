@@ -43,3 +43,28 @@ def loadAndTestBasicData(randomize):
 
     assert ordered != randomize, "If should be randomized but appears ordered, try different seed (and check for datasets / numpy rng changes)"
     assert len(ids) == 5
+
+
+def testLoadDataStreaming():
+    dp = DataProcessor("test/resources/data.template")
+    data = dp.loadData("test/resources/data-mixed.json", seed=42, streaming=True, bufferSize=10)
+
+    entries = list(data)
+    assert len(entries) == 5
+    assert all(list(entry.keys()) == ['input'] for entry in entries)
+    assert sum(1 for entry in entries if addPattern.match(entry['input'])) == 1
+    assert entries == list(dp.loadData("test/resources/data-mixed.json", seed=42, streaming=True, bufferSize=10))
+
+
+def testLoadDataWithPrompt():
+    dp = DataProcessor("test/resources/data.template")
+    data = dp.loadData("test/resources/data-mixed.json", randomize=False, withPrompt=True)
+
+    for entry in data:
+        assert entry['prompt'].endswith("out:")
+        assert entry['input'].startswith(entry['prompt'])
+        assert entry['input'][len(entry['prompt']):].startswith("data point")
+
+def testLoadDataWithPromptRequiresTemplate():
+    with pytest.raises(ValueError):
+        DataProcessor().loadData("test/resources/data-basic.json", withPrompt=True)
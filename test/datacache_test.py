@@ -0,0 +1,49 @@
+import os
+import pytest
+
+import datasets
+
+from modules.datacache import DataCache
+
+dataPath = "test/resources/data-basic.json"
+templatePath = "test/resources/data.template"
+
+
+@pytest.fixture
+def cacheDir(tmp_path):
+    return str(tmp_path / "data-cache")
+
+
+def testFingerprintStable(cacheDir):
+    cache = DataCache(cacheDir)
+    assert cache.fingerprint(dataPath, templatePath, "tok", 256) == cache.fingerprint(dataPath, templatePath, "tok", 256)
+
+def testFingerprintChanges(cacheDir):
+    cache = DataCache(cacheDir)
+    fp = cache.fingerprint(dataPath, templatePath, "tok", 256)
+    assert fp != cache.fingerprint("test/resources/data-mixed.json", templatePath, "tok", 256)
+    assert fp != cache.fingerprint(dataPath, None, "tok", 256)
+    assert fp != cache.fingerprint(dataPath, templatePath, "other", 256)
+    assert fp != cache.fingerprint(dataPath, templatePath, "tok", 512)
+    assert fp != cache.fingerprint(dataPath, templatePath, "tok", 256, seed=1)
+
+def testSaveAndLoad(cacheDir):
+    cache = DataCache(cacheDir)
+    fp = cache.fingerprint(dataPath, templatePath, "tok", 256)
+    assert cache.load(fp) is None
+
+    data = datasets.Dataset.from_dict({"input_ids" : [[1, 2], [3, 4, 5]]})
+    saved = cache.save(fp, data)
+    assert saved["input_ids"] == [[1, 2], [3, 4, 5]]
+    assert cache.load(fp)["input_ids"] == [[1, 2], [3, 4, 5]]
+    assert os.listdir(cacheDir) == [fp]
+
+def testSaveRemovesStaleEntries(cacheDir):
+    cache = DataCache(cacheDir)
+    data = datasets.Dataset.from_dict({"input_ids" : [[1, 2]]})
+    old = cache.fingerprint(dataPath, templatePath, "tok", 256)
+    cache.save(old, data)
+    new = cache.fingerprint(dataPath, templatePath, "tok", 512)
+    cache.save(new, data)
+    assert os.listdir(cacheDir) == [new]
+    assert cache.load(old) is None
@@ -0,0 +1,51 @@
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from modules.device import resolveDevice, resolveDtype, configureThreads, quantizeDynamic
+
+
+def testResolveDevice():
+    assert resolveDevice("cpu") == "cpu"
+    assert resolveDevice(None) in ("cuda", "cpu")
+
+def testResolveDtype():
+    assert resolveDtype("bfloat16", "cpu") == torch.bfloat16
+    assert resolveDtype(None, "cuda") == torch.float16
+    assert resolveDtype(None, "cpu") in (torch.bfloat16, torch.float32)
+    with pytest.raises(ValueError):
+        resolveDtype("int4", "cpu")
+
+def testConfigureThreads():
+    threads = torch.get_num_threads()
+    try:
+        configureThreads(1)
+        assert torch.get_num_threads() == 1
+    finally:
+        torch.set_num_threads(threads)
+
+def testQuantizeDynamicKeepsLoRALayers():
+    model = torch.nn.Module()
+    model.proj = torch.nn.Linear(8, 8)
+    model.lora_A = torch.nn.Linear(8, 2)
+    input = torch.rand(3, 8)
+    expected = model.proj(input)
+
+    model = quantizeDynamic(model)
+    assert type(model.lora_A) is torch.nn.Linear
+    assert type(model.proj) is not torch.nn.Linear
+    assert torch.allclose(model.proj(input), expected, atol=0.05)
+
+def testQuantizeDynamicConvertsConv1DAndKeepsOutputEmbeddings():
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=50, n_positions=16, n_embd=16, n_layer=1, n_head=2)).eval()
+    ids = torch.randint(0, 50, (2, 8))
+    expected = model(ids).logits
+
+    model = quantizeDynamic(model)
+    attention = model.transformer.h[0].attn
+    assert type(attention.c_attn) is torch.ao.nn.quantized.dynamic.Linear
+    assert type(attention.c_proj) is torch.ao.nn.quantized.dynamic.Linear
+    assert type(model.lm_head) is torch.nn.Linear
+    assert model.lm_head.weight is model.transformer.wte.weight
+    assert torch.allclose(model(ids).logits, expected, atol=0.1)
@@ -0,0 +1,40 @@
+import os
+import json
+import pytest
+
+from modules.settings import Settings
+from modules.distributed import (
+    launchWorkers, isDistributed, rank, worldSize, isMainProcess, mainProcessFirst, sumAcrossProcesses
+)
+
+
+def testSingleProcess():
+    assert not isDistributed()
+    assert (rank(), worldSize(), isMainProcess()) == (0, 1, True)
+    assert sumAcrossProcesses([1, 2.5]) == [1, 2.5]
+    with mainProcessFirst():
+        pass
+
+
+# Runs in each worker process. Records order of mainProcessFirst blocks and the sum of all ranks.
+def recordWorker(settings, path):
+    with mainProcessFirst():
+        with open(os.path.join(path, "order"), 'a') as file:
+            file.write(f"{rank()}\n")
+    total = sumAcrossProcesses([rank() + 1])[0]
+    with open(os.path.join(path, f"rank-{rank()}.json"), 'w') as file:
+        json.dump({ "worldSize" : worldSize(), "total" : total, "threads" : settings.base.threads }, file)
+
+
+def testLaunchWorkers(tmp_path):
+    settings = Settings("test/resources/settings-min.json")
+    settings.distributed.processes = 2
+    settings.distributed.masterPort = 29631
+    launchWorkers(recordWorker, settings, str(tmp_path))
+
+    assert (tmp_path / "order").read_text().split()[0] == "0"
+    for r in range(2):
+        result = json.loads((tmp_path / f"rank-{r}.json").read_text())
+        assert result["worldSize"] == 2
+        assert result["total"] == 3
+        assert result["threads"] >= 1
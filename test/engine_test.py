@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+import torch
+
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from modules.engine import GenerationEngine, GenerationRequest, AsyncTextStreamer
+from modules.prefixcache import PrefixCache
+
+
+def makeModel():
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=64, n_positions=256, n_embd=32, n_layer=2, n_head=2)
+    return GPT2LMHeadModel(config).eval()
+
+
+# Cancels its request after a number of tokens, as a consumer going away would.
+class CancellingStreamer:
+    def __init__(self, cancelAfter):
+        self.cancelAfter = cancelAfter
+        self.tokens = []
+        self.request = None
+
+    def put(self, token):
+        self.tokens.extend(token.tolist())
+        if len(self.tokens) == self.cancelAfter:
+            self.request.cancel()
+
+    def end(self):
+        pass
+
+
+class CharTokenizer:
+    def decode(self, ids, **kwargs):
+        return "".join(chr(ord('a') + i % 26) for i in ids)
+
+
+def submit(engine, prompt, cancelAfter, limit):
+    streamer = CancellingStreamer(cancelAfter)
+    request = GenerationRequest(torch.tensor([prompt]), streamer, limit=limit, temp=0)
+    streamer.request = request
+    engine.submit(request)
+    return request
+
+
+@pytest.fixture(scope="module")
+def model():
+    return makeModel()
+
+
+def testCancelStopsGeneration(model):
+    engine = GenerationEngine(model, eosTokenId=-1)
+    cancelled = submit(engine, [1, 2, 3], cancelAfter=3, limit=100)
+    running = submit(engine, [4, 5, 6, 7], cancelAfter=-1, limit=20)
+    cancelled.wait()
+    running.wait()
+    assert len(cancelled.streamer.tokens) == 3
+    assert len(running.streamer.tokens) == 20
+    assert engine.tokenCount == 23
+
+def testCancelledRequestNotStarted(model):
+    engine = GenerationEngine(model, eosTokenId=-1)
+    request = GenerationRequest(torch.tensor([[1, 2, 3]]), CancellingStreamer(-1), limit=10)
+    request.cancel()
+    engine.submit(request)
+    request.wait()
+    assert request.streamer.tokens == []
+    assert request.error is None
+
+def testAsyncStreamer(model):
+    engine = GenerationEngine(model, eosTokenId=-1)
+
+    async def generate():
+        streamer = AsyncTextStreamer(CharTokenizer(), asyncio.get_running_loop())
+        request = GenerationRequest(torch.tensor([[1, 2, 3]]), streamer, limit=8, temp=0)
+        engine.submit(request)
+        return "".join([text async for text in streamer])
+
+    text = asyncio.run(generate())
+    assert len(text) == 8
+
+def testCloseEndsWorkerAfterRequestsInFlight(model):
+    engine = GenerationEngine(model, eosTokenId=-1)
+    request = submit(engine, [1, 2, 3], cancelAfter=-1, limit=10)
+    engine.close()
+    request.wait()
+    engine.thread.join(timeout=10)
+    assert not engine.thread.is_alive()
+    assert len(request.streamer.tokens) == 10
+
+def testPrefixCacheKeyedByWeights(model):
+    engine = GenerationEngine(model, eosTokenId=-1, prefixCache=PrefixCache(10**8, minLength=2))
+    def run(weights):
+        request = GenerationRequest(torch.tensor([[1, 2, 3, 4, 5]]), CancellingStreamer(-1), limit=2, temp=0,
+                                    adapter="default", weights=weights)
+        engine.submit(request)
+        request.wait()
+    run("a")
+    run("a")
+    assert [key[0] for key in engine.prefixCache.entries] == ["a"]
+    assert engine.prefixCache.lookup("b", [1, 2, 3, 4, 5]) == (0, None)
+    assert engine.prefixCache.lookup("a", [1, 2, 3, 4, 5])[0] == 4
@@ -0,0 +1,77 @@
+import os
+import json
+import struct
+import pytest
+
+from modules.inspection import readCheckpoint, readBaseModel, findAdapter, moduleTotals, estimateMemory
+
+
+def writeSafetensors(path, tensors):
+    header = { "__metadata__" : { "format" : "pt" } }
+    offset = 0
+    for name, (dtype, shape, itemSize) in tensors.items():
+        size = itemSize
+        for dim in shape:
+            size *= dim
+        header[name] = { "dtype" : dtype, "shape" : shape, "data_offsets" : [offset, offset + size] }
+        offset += size
+
+    data = json.dumps(header).encode()
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<Q', len(data)))
+        file.write(data)
+        file.write(b'\0' * offset)
+
+baseTensors = {
+    "model.embed_tokens.weight" : ("F16", [10, 4], 2),
+    "model.layers.0.self_attn.q_proj.weight" : ("F16", [4, 4], 2),
+    "model.layers.0.self_attn.q_proj.bias" : ("F16", [4], 2),
+    "model.layers.1.self_attn.q_proj.weight" : ("F16", [4, 4], 2),
+    "lm_head.weight" : ("F32", [10, 4], 4)
+}
+
+
+def testSingleFile(tmp_path):
+    writeSafetensors(tmp_path / "model.safetensors", baseTensors)
+    tensors = readBaseModel(str(tmp_path))
+    assert [t.name for t in tensors] == list(baseTensors)
+    assert tensors[0].shape == [10, 4]
+    assert tensors[0].params == 40
+    assert tensors[0].size == 80
+    assert tensors[4].dtype == "F32"
+    assert tensors[4].size == 160
+
+def testShardedIndex(tmp_path):
+    names = list(baseTensors)
+    writeSafetensors(tmp_path / "model-1.safetensors", { n : baseTensors[n] for n in names[:2] })
+    writeSafetensors(tmp_path / "model-2.safetensors", { n : baseTensors[n] for n in names[2:] })
+    weightMap = { n : ("model-1.safetensors" if i < 2 else "model-2.safetensors") for i, n in enumerate(names) }
+    with open(tmp_path / "model.safetensors.index.json", 'w') as file:
+        json.dump({ "weight_map" : weightMap }, file)
+
+    assert sorted(t.name for t in readCheckpoint(str(tmp_path))) == sorted(names)
+
+def testModuleTotals(tmp_path):
+    writeSafetensors(tmp_path / "model.safetensors", baseTensors)
+    totals = moduleTotals(readBaseModel(str(tmp_path)))
+    assert totals["model.layers.*.self_attn.q_proj"] == (3, 36, 72)
+    assert totals["lm_head"] == (1, 40, 160)
+
+def testEstimateMemory(tmp_path):
+    writeSafetensors(tmp_path / "model.safetensors", baseTensors)
+    tensors = readBaseModel(str(tmp_path))
+    # 32 quantizable params in the q_proj weights, 84 others at 16 bits.
+    assert estimateMemory(tensors, 16) == 116 * 2
+    assert estimateMemory(tensors, 8) == 32 + 84 * 2
+    assert estimateMemory(tensors, 4) == 16 + 84 * 2
+
+def testFindAdapter(tmp_path):
+    assert findAdapter(str(tmp_path)) is None
+    checkpoint = tmp_path / "checkpoint-10"
+    checkpoint.mkdir()
+    writeSafetensors(checkpoint / "adapter_model.safetensors", { "lora_A.weight" : ("F32", [2, 4], 4) })
+    assert findAdapter(str(tmp_path)) == str(checkpoint)
+
+    writeSafetensors(tmp_path / "adapter_model.safetensors", { "lora_A.weight" : ("F32", [2, 4], 4) })
+    assert findAdapter(str(tmp_path)) == str(tmp_path)
+    assert readCheckpoint(str(tmp_path), "adapter_model")[0].params == 8
@@ -0,0 +1,29 @@
+import pytest
+
+from modules.merging import adapterHash, isMergeCurrent, writeMergeInfo
+
+
+def writeAdapter(path, content):
+    path.mkdir(exist_ok=True)
+    (path / "adapter_config.json").write_text("{}")
+    (path / "adapter_model.safetensors").write_bytes(content)
+    (path / "README.md").write_text("ignored")
+
+
+def testAdapterHash(tmp_path):
+    writeAdapter(tmp_path / "a", b"123")
+    writeAdapter(tmp_path / "b", b"123")
+    writeAdapter(tmp_path / "c", b"124")
+    assert adapterHash(str(tmp_path / "a")) == adapterHash(str(tmp_path / "b"))
+    assert adapterHash(str(tmp_path / "a")) != adapterHash(str(tmp_path / "c"))
+
+    (tmp_path / "b" / "README.md").write_text("changed")
+    assert adapterHash(str(tmp_path / "a")) == adapterHash(str(tmp_path / "b"))
+
+def testMergeInfo(tmp_path):
+    merged = str(tmp_path)
+    assert not isMergeCurrent(merged, "base", "hash")
+    writeMergeInfo(merged, "base", "hash")
+    assert isMergeCurrent(merged, "base", "hash")
+    assert not isMergeCurrent(merged, "other", "hash")
+    assert not isMergeCurrent(merged, "base", "other")
@@ -5,13 +5,17 @@ Uses huggingface libs and gpt2 model from huggingface repository. (https://huggi
 Note: The model download is ~550MB. Model should be cached on disk using hf mechanisms.
 """
 import os
+import numpy
 import pytest
+from threading import Thread
 
+from torch import stack # pylint: disable=no-name-in-module
 from torch.nn.functional import cosine_similarity
 
 from modules.settings import Settings
 from modules.data import DataProcessor
 from modules.model import (Model, Tokenizer)
+from modules.telemetry import telemetryFileName
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -47,24 +51,90 @@ def testlookupEmbeddings(inferenceModel):
     s = cosine_similarity(cat[0], dog[0], dim=0)
     assert s > 0 and s < 1
 
+def testSimilarityMatrix(inferenceModel):
+    embeddings, counts = inferenceModel.lookupEmbeddingsBatch(["cat", "dog", "house"])
+    assert counts == [1, 1, 1]
+    matrix = inferenceModel.similarityMatrix(embeddings)
+    assert list(matrix.shape) == [3, 3]
+    s = cosine_similarity(inferenceModel.lookupEmbeddings("cat")[0], inferenceModel.lookupEmbeddings("dog")[0], dim=0)
+    assert abs(matrix[0][1].item() - s.item()) < 1e-3
+    assert abs(matrix[1][1].item() - 1) < 1e-3
+
 def testfindSimilarTokens(inferenceModel):
     cat = inferenceModel.lookupEmbeddings("cat")[0]
     results = inferenceModel.findSimilarTokens(cat, 10)
     assert len(results) == 10
     assert results[0] == ("cat", 1.0)
 
+def testfindSimilarTokensBatch(inferenceModel):
+    cat = inferenceModel.lookupEmbeddings("cat")[0]
+    dog = inferenceModel.lookupEmbeddings("dog")[0]
+    results = inferenceModel.findSimilarTokensBatch(stack([cat, dog]), 5)
+    assert len(results) == 2
+    assert results[0] == inferenceModel.findSimilarTokens(cat, 5)
+    assert results[1] == inferenceModel.findSimilarTokens(dog, 5)
+    assert results[1][0][0] == "dog"
+
 def testGenerate(inferenceModel):
     result = inferenceModel.generate("hello", limit=5)
     for n, _ in enumerate(result, start=1):
         assert n <= 6
     assert n == 6
 
+def testGenerateConcurrent(inferenceModel):
+    prompts = ["hello", "the cat sat on the mat", "one two three four five six seven"]
+    results = {}
+    def run(prompt):
+        results[prompt] = "".join(inferenceModel.generate(prompt, limit=8, temp=0))
+
+    threads = [Thread(target=run, args=(p,)) for p in prompts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for p in prompts:
+        assert results[p] == "".join(inferenceModel.generate(p, limit=8, temp=0))
+
+def testGenerateBatch(inferenceModel):
+    prompts = ["hello", "the cat sat on the mat", "one two three four five six seven"]
+    results = dict(inferenceModel.generateBatch(prompts, batchSize=2, limit=8, temp=0))
+    assert sorted(results) == [0, 1, 2]
+    for i, p in enumerate(prompts):
+        assert results[i] == "".join(inferenceModel.generate(p, limit=8, temp=0))
+
+def testScore(inferenceModel):
+    dp = DataProcessor("data.template")
+    data = dp.loadData("data-mixed.json", randomize=False, withPrompt=True)
+    batched = { i : (ll, count) for i, ll, count in inferenceModel.score(data, batchSize=4) }
+    single = { i : (ll, count) for i, ll, count in inferenceModel.score(data, batchSize=1) }
+    assert sorted(batched) == list(range(len(data)))
+    for i in batched:
+        assert batched[i][0] == pytest.approx(single[i][0], rel=1e-3)
+        assert batched[i][1] == single[i][1]
+
+    outputOnly = { i : count for i, _, count in inferenceModel.score(data, outputOnly=True) }
+    assert all(0 < outputOnly[i] < batched[i][1] for i in batched)
+
+def testExportEmbeddings(inferenceModel, tmp_path):
+    path = str(tmp_path / "embeddings.npy")
+    tokens = inferenceModel.exportEmbeddings(path, chunkRows=10000)
+    embeddings = numpy.load(path, mmap_mode='r')
+    assert embeddings.shape[0] == len(tokens)
+    id = tokens.index("cat")
+    assert numpy.allclose(embeddings[id], inferenceModel.lookupEmbeddings("cat")[0].detach().float().cpu().numpy(), atol=1e-4)
+
+def testGenerateUnknownAdapter(inferenceModel):
+    with pytest.raises(ValueError):
+        list(inferenceModel.generate("hello", limit=5, adapter="missing"))
+
 def testTrain(trainingModel):
     settings = Settings("settings-training.json")
 
-    adapterFiles = ["adapter_config.json", "adapter_model.bin", "README.md"]
+    adapterFiles = ["adapter_config.json", "adapter_model.safetensors", "README.md"]
     adapterFiles = [ os.path.join(settings.training.outputPath, f) for f in adapterFiles ]
-    deleteFiles(adapterFiles)
+    telemetryFile = os.path.join(settings.training.outputPath, telemetryFileName)
+    deleteFiles(adapterFiles + [telemetryFile])
 
     dp = DataProcessor(settings.training.templatePath)
     data = dp.loadData(settings.training.dataPath)
@@ -72,6 +142,7 @@ def testTrain(trainingModel):
         trainingModel.train(data)
         for f in adapterFiles:
             assert os.path.exists(f)
+        assert os.path.exists(telemetryFile)
 
     except RuntimeError as re:
         assert not "unscale_() has already been called on this optimizer" in str(re),\
@@ -79,7 +150,7 @@ def testTrain(trainingModel):
         raise
 
     finally:
-        deleteFiles(adapterFiles)
+        deleteFiles(adapterFiles + [telemetryFile])
         os.rmdir(settings.training.outputPath)
 
 
@@ -0,0 +1,95 @@
+import pytest
+import torch
+
+from tokenizers import Tokenizer as WordTokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+from transformers import PreTrainedTokenizerFast
+
+from modules.model import Model, Tokenizer
+
+
+# Id 0 (padding) is a regular word, as "!" is for GPT2.
+words = ["!", "<eos>", "a", "b", "c", "dog", "cat", "in"]
+
+
+def makeTokenizer():
+    wordTokenizer = WordTokenizer(WordLevel({ w : i for i, w in enumerate(words) }, unk_token="!"))
+    wordTokenizer.pre_tokenizer = Whitespace()
+    tokenizer = Tokenizer.__new__(Tokenizer)
+    tokenizer.tokenizer = PreTrainedTokenizerFast(tokenizer_object=wordTokenizer, eos_token="<eos>", clean_up_tokenization_spaces=False)
+    tokenizer.tokenizer.padding_side = "left"
+    tokenizer.tokenizer.pad_token_id = 0
+    return tokenizer
+
+
+# Continues each prompt with a fixed sequence picked by its last token. Rows ending early are
+# padded like HF generate does.
+class FakeModel:
+    continuations = { 2 : [7, 5, 1], 3 : [6, 6, 6, 6, 6] }
+
+    def __init__(self):
+        self.config = type("Config", (), {})()
+
+    def generate(self, input_ids, max_new_tokens, pad_token_id, **kwargs):
+        rows = [self.continuations[ids[-1]][:max_new_tokens] for ids in input_ids.tolist()]
+        width = max(len(r) for r in rows)
+        rows = [r + [pad_token_id] * (width - len(r)) for r in rows]
+        return torch.cat([input_ids, torch.tensor(rows)], dim=1)
+
+    def get_input_embeddings(self):
+        torch.manual_seed(0)
+        return torch.nn.Embedding(len(words), 4)
+
+
+def makeModel():
+    model = Model.__new__(Model)
+    model.model = FakeModel()
+    model.tokenizer = makeTokenizer()
+    model.device = "cpu"
+    return model
+
+
+def testGenerateBatchCutsAtEos():
+    results = dict(makeModel().generateBatch(["a", "c b"], batchSize=2, limit=8, temp=0))
+    assert results == { 0 : "in dog", 1 : "cat cat cat cat cat" }
+
+def testEmbeddingsOfEmptyInputs():
+    model = makeModel()
+    embeddings, counts = model.lookupEmbeddingsBatch(["dog", "", " ", "cat in"])
+    assert counts == [1, 0, 0, 2]
+    assert embeddings[1].abs().sum() == 0 and embeddings[2].abs().sum() == 0
+    matrix = model.similarityMatrix(embeddings)
+    assert not matrix.isnan().any()
+    assert matrix[0, 1] == 0
+
+def testResolveAdapter():
+    model = Model.__new__(Model)
+    model.adapters = {}
+    assert model._resolveAdapter(None) == "__base__"
+    model.adapters = { "legal" : "out/legal", "medical" : "out/medical" }
+    assert model._resolveAdapter(None) == "legal"
+    assert model._resolveAdapter("medical") == "medical"
+    model.adapters = { "default" : "out", "legal" : "out/legal" }
+    assert model._resolveAdapter(None) == "default"
+    with pytest.raises(ValueError):
+        model._resolveAdapter("unknown")
+
+def testWarmupBypassesResponseCache():
+    class UnusedCache:
+        def __getattr__(self, name):
+            raise AssertionError(f"Response cache used: {name}")
+
+    submitted = []
+    def submit(input, streamer, limit, temp, top_p, top_k, adapter):
+        submitted.append((input, adapter))
+        streamer.end()
+        return type("Request", (), { "wait" : lambda self: None })()
+
+    model = Model.__new__(Model)
+    model.tokenizer = makeTokenizer()
+    model.adapters = {}
+    model.responseCache = UnusedCache()
+    model._submit = submit
+    model.warmup()
+    assert submitted == [("Hello", "__base__")]
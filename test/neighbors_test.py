@@ -0,0 +1,44 @@
+import numpy
+import pytest
+import torch
+
+from modules.neighbors import blockSize, nearestNeighbors
+
+
+def bruteForce(embeddings, k):
+    normalized = embeddings / numpy.linalg.norm(embeddings, axis=1, keepdims=True)
+    similarities = normalized @ normalized.T
+    numpy.fill_diagonal(similarities, -numpy.inf)
+    ids = numpy.argsort(-similarities, axis=1)[:, :k]
+    return ids, numpy.take_along_axis(similarities, ids, axis=1)
+
+
+def testBlockSizeWithinBudget():
+    assert blockSize(1000, 16, 5, 10**9) == 1000
+    size = blockSize(1000, 16, 5, 100_000)
+    assert 1 <= size < 1000
+    assert 4 * (2 * size * 16 + size * size) + 12 * size * (5 + size) <= 100_000
+
+@pytest.mark.parametrize("memoryBudget", [10**9, 20_000])
+def testMatchesBruteForce(memoryBudget):
+    embeddings = numpy.random.default_rng(0).standard_normal((103, 8)).astype(numpy.float32)
+    ids = numpy.zeros((103, 4), dtype=numpy.int32)
+    scores = numpy.zeros((103, 4), dtype=numpy.float16)
+    nearestNeighbors(embeddings, ids, scores, memoryBudget)
+
+    expectedIds, expectedScores = bruteForce(embeddings, 4)
+    assert numpy.array_equal(ids, expectedIds)
+    assert numpy.allclose(scores, expectedScores, atol=1e-3)
+
+def testMemoryMappedInput(tmp_path):
+    path = str(tmp_path / "embeddings.npy")
+    numpy.save(path, numpy.random.default_rng(1).standard_normal((20, 4)).astype(numpy.float32))
+    embeddings = numpy.load(path, mmap_mode='r')
+    ids = numpy.zeros((20, 3), dtype=numpy.int32)
+    scores = numpy.zeros((20, 3), dtype=numpy.float32)
+    nearestNeighbors(embeddings, ids, scores, 2_000)
+    assert numpy.array_equal(ids, bruteForce(numpy.asarray(embeddings), 3)[0])
+
+def testTooManyNeighbors():
+    with pytest.raises(ValueError):
+        nearestNeighbors(numpy.ones((3, 2), dtype=numpy.float32), numpy.zeros((3, 3)), numpy.zeros((3, 3)), 10**6)
@@ -0,0 +1,73 @@
+import pytest
+
+import datasets
+import torch
+from transformers import GPT2Config, LlamaConfig, LlamaForCausalLM
+
+from modules.packing import SequencePacker, PackedCollator, paddingRatio, blockDiagonalMask, usesFlashAttention
+
+EOS = 9
+
+
+# Packed blocks as rows of a data set.
+def packedFeatures(samples, cutoff=8):
+    result = SequencePacker(cutoff, EOS).pack({ "input_ids" : samples })
+    return [dict(zip(result, values)) for values in zip(*result.values())]
+
+
+def testPackIntoBlocks():
+    packer = SequencePacker(8, EOS)
+    result = packer.pack({ "input_ids" : [[1, 2, EOS], [3, 4], [5, 6, 7, 8]] })
+
+    assert result["input_ids"] == [[1, 2, EOS, 3, 4, EOS, 0, 0], [5, 6, 7, 8, EOS, 0, 0, 0]]
+    assert result["attention_mask"] == [[1, 1, 1, 1, 1, 1, 0, 0], [1, 1, 1, 1, 1, 0, 0, 0]]
+    assert result["position_ids"] == [[0, 1, 2, 0, 1, 2, 0, 0], [0, 1, 2, 3, 4, 0, 0, 0]]
+
+def testLabelsDoNotCrossSamples():
+    packer = SequencePacker(8, EOS)
+    result = packer.pack({ "input_ids" : [[1, 2, EOS], [3, 4]] })
+    assert result["labels"] == [[-100, 2, EOS, -100, 4, EOS, -100, -100]]
+
+def testFullLengthSampleKeepsEOS():
+    packer = SequencePacker(4, EOS)
+    result = packer.pack({ "input_ids" : [[1, 2, 3, 4], [5]] })
+    assert result["input_ids"] == [[1, 2, 3, EOS], [5, EOS, 0, 0]]
+
+def testPaddingRatio():
+    packer = SequencePacker(8, EOS)
+    data = datasets.Dataset.from_dict({ "input_ids" : [[1, 2, EOS], [3, 4], [5, 6, 7, 8]] })
+    data = data.map(packer.pack, batched=True, remove_columns=data.column_names)
+    assert len(data) == 2
+    assert paddingRatio(data, 8) == pytest.approx(5 / 16)
+
+def testBlockDiagonalMask():
+    mask = blockDiagonalMask(torch.tensor([[0, 1, 2, 0, 1, 0]]), torch.float32)
+    allowed = (mask[0, 0] == 0).int().tolist()
+    assert allowed == [
+        [1, 0, 0, 0, 0, 0],
+        [1, 1, 0, 0, 0, 0],
+        [1, 1, 1, 0, 0, 0],
+        [0, 0, 0, 1, 0, 0],
+        [0, 0, 0, 1, 1, 0],
+        [0, 0, 0, 0, 0, 1]]
+
+def testPackedSamplesDoNotAttendToEachOther():
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=16, hidden_size=16, intermediate_size=32, num_hidden_layers=1,
+                         num_attention_heads=2, attn_implementation="sdpa")
+    model = LlamaForCausalLM(config).eval()
+    batch = PackedCollator(torch.float32, usesFlashAttention(config))(packedFeatures([[1, 2, EOS], [3, 4]]))
+
+    packed = model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"], position_ids=batch["position_ids"]).logits
+    alone = model(input_ids=torch.tensor([[3, 4, EOS]])).logits
+    assert torch.allclose(packed[0, 3:6], alone[0], atol=1e-5)
+
+def testPackingRequiresSupportedAttention():
+    assert usesFlashAttention(LlamaConfig(attn_implementation="flash_attention_2"))
+    with pytest.raises(ValueError):
+        usesFlashAttention(GPT2Config(attn_implementation="eager"))
+
+def testFlashAttentionCollatorDropsMask():
+    batch = PackedCollator(torch.float32, flashAttention=True)(packedFeatures([[1, 2, EOS], [3, 4]]))
+    assert "attention_mask" not in batch
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0, 1, 2, 0, 0]]
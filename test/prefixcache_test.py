@@ -0,0 +1,66 @@
+import pytest
+import torch
+
+from modules.prefixcache import PrefixCache
+
+
+def makePast(length, layers=2):
+    return tuple((torch.rand(1, 2, length, 4), torch.rand(1, 2, length, 4)) for _ in range(layers))
+
+def entrySize(length, layers=2):
+    return layers * 2 * 2 * length * 4 * 4
+
+
+def testCommonPrefixIsStored():
+    cache = PrefixCache(1024 * 1024, minLength=3)
+    cache.store("a", [1, 2, 3, 4, 5], makePast(5))
+    assert cache.lookup("a", [1, 2, 3, 4, 9]) == (0, None)
+
+    past = makePast(5)
+    cache.store("a", [1, 2, 3, 4, 9], past)
+    length, cached = cache.lookup("a", [1, 2, 3, 4, 7, 8])
+    assert length == 4
+    assert torch.equal(cached[0][0], past[0][0][..., :4, :])
+
+def testShortPrefixIgnored():
+    cache = PrefixCache(1024 * 1024, minLength=3)
+    cache.store("a", [1, 2, 5], makePast(3))
+    cache.store("a", [1, 2, 6], makePast(3))
+    assert len(cache.entries) == 0
+
+def testAdapterIdentity():
+    cache = PrefixCache(1024 * 1024, minLength=2)
+    cache.store("a", [1, 2, 3, 4], makePast(4))
+    cache.store("b", [1, 2, 3, 5], makePast(4))
+    assert len(cache.entries) == 0
+    cache.store("a", [1, 2, 3, 6], makePast(4))
+    assert cache.lookup("b", [1, 2, 3, 7]) == (0, None)
+    assert cache.lookup("a", [1, 2, 3, 7])[0] == 3
+
+def testIdenticalPromptKeepsLastToken():
+    cache = PrefixCache(1024 * 1024, minLength=2)
+    cache.store("a", [1, 2, 3, 4], makePast(4))
+    cache.store("a", [1, 2, 3, 4], makePast(4))
+    assert cache.lookup("a", [1, 2, 3, 4])[0] == 3
+
+def testLongestPrefixWins():
+    cache = PrefixCache(1024 * 1024, minLength=2)
+    cache.store("a", [1, 2, 8], makePast(3))
+    cache.store("a", [1, 2, 9], makePast(3))
+    cache.store("a", [1, 2, 3, 4, 8], makePast(5))
+    cache.store("a", [1, 2, 3, 4, 9], makePast(5))
+    assert cache.lookup("a", [1, 2, 3, 4, 5])[0] == 4
+    assert cache.lookup("a", [1, 2, 7])[0] == 2
+
+def testLruEviction():
+    cache = PrefixCache(entrySize(3) * 2, minLength=3)
+    for first in (1, 2, 3):
+        cache.store("a", [first, 0, 0, 5], makePast(4))
+        cache.store("a", [first, 0, 0, 6], makePast(4))
+        if first == 2:
+            assert cache.lookup("a", [1, 0, 0, 7])[0] == 3
+
+    assert cache.used <= cache.memoryBudget
+    assert cache.lookup("a", [1, 0, 0, 7])[0] == 3
+    assert cache.lookup("a", [2, 0, 0, 7]) == (0, None)
+    assert cache.lookup("a", [3, 0, 0, 7])[0] == 3
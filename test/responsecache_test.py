@@ -0,0 +1,95 @@
+import os
+import pytest
+
+from modules.responsecache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def testKeyCoversRequest():
+    key = ResponseCache.key("model", "prompt", 128, 0.1, 0.75, 40)
+    assert key == ResponseCache.key("model", "prompt", 128, 0.1, 0.75, 40)
+    assert key != ResponseCache.key("other", "prompt", 128, 0.1, 0.75, 40)
+    assert key != ResponseCache.key("model", "prompt ", 128, 0.1, 0.75, 40)
+    assert key != ResponseCache.key("model", "prompt", 64, 0.1, 0.75, 40)
+    assert key != ResponseCache.key("model", "prompt", 128, 0, 0.75, 40)
+    assert key != ResponseCache.key("model", "prompt", 128, 0.1, 0.9, 40)
+    assert key != ResponseCache.key("model", "prompt", 128, 0.1, 0.75, 50)
+
+def testStoreAndLookup():
+    cache = ResponseCache(4)
+    assert cache.lookup("a") is None
+    cache.store("a", ["Hello", " world"])
+    assert cache.lookup("a") == ["Hello", " world"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def testLeastRecentlyUsedEvicted():
+    cache = ResponseCache(2)
+    cache.store("a", ["1"])
+    cache.store("b", ["2"])
+    cache.lookup("a")
+    cache.store("c", ["3"])
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") == ["1"]
+    assert cache.lookup("c") == ["3"]
+
+def testExpiry():
+    clock = Clock()
+    cache = ResponseCache(4, ttl=60, clock=clock)
+    cache.store("a", ["1"])
+    clock.now += 59
+    assert cache.lookup("a") == ["1"]
+    clock.now += 2
+    assert cache.lookup("a") is None
+    assert len(cache.entries) == 0
+
+def testDiskTier(tmp_path):
+    clock = Clock()
+    cache = ResponseCache(4, ttl=60, path=str(tmp_path), clock=clock)
+    cache.store("a", ["Hello", " world"])
+
+    restarted = ResponseCache(4, ttl=60, path=str(tmp_path), clock=clock)
+    assert restarted.lookup("a") == ["Hello", " world"]
+    assert "a" in restarted.entries
+
+    clock.now += 61
+    assert ResponseCache(4, ttl=60, path=str(tmp_path), clock=clock).lookup("a") is None
+    assert os.listdir(tmp_path) == []
+
+def testDiskPruning(tmp_path):
+    cache = ResponseCache(100, path=str(tmp_path), diskEntries=10)
+    for i in range(11):
+        cache.store(str(i), [str(i)])
+        os.utime(tmp_path / f"{i}.json", (i, i))
+    assert sorted(os.listdir(tmp_path)) == sorted(f"{i}.json" for i in range(2, 11))
+
+def testDiskCountWithoutListing(tmp_path, monkeypatch):
+    ResponseCache(100, path=str(tmp_path)).store("a", ["1"])
+    cache = ResponseCache(100, path=str(tmp_path), diskEntries=10)
+    assert cache.diskCount == 1
+
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listings.append(path) or listdir(path))
+    for i in range(9):
+        cache.store(str(i), [str(i)])
+    cache.store("a", ["2"])
+    assert cache.diskCount == 10
+    assert listings == []
+
+    cache.store("pruned", ["3"])
+    assert len(listings) == 1
+    assert cache.diskCount == len(listdir(tmp_path)) == 9
+
+def testClear(tmp_path):
+    cache = ResponseCache(4, path=str(tmp_path))
+    cache.store("a", ["1"])
+    cache.clear()
+    assert cache.lookup("a") is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,66 @@
+import pytest
+
+from modules.sampler import TokenBudgetBatchSampler
+
+
+def testBatchesStayWithinBudget():
+    lengths = [5, 100, 20, 7, 30, 8, 90, 6]
+    sampler = TokenBudgetBatchSampler(lengths, tokensPerBatch=100)
+    batches = list(sampler)
+    assert sorted(i for b in batches for i in b) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) * max(lengths[i] for i in batch) <= 100
+    assert len(sampler) == len(batches)
+
+def testOversizedSampleGetsOwnBatch():
+    sampler = TokenBudgetBatchSampler([10, 500, 10], tokensPerBatch=100)
+    assert [1] in list(sampler)
+
+def testShortSamplesShareBatches():
+    sampler = TokenBudgetBatchSampler([10] * 20 + [100] * 2, tokensPerBatch=100)
+    assert sorted(len(b) for b in sampler) == [1, 1, 10, 10]
+
+def testOrderChangesPerEpoch():
+    sampler = TokenBudgetBatchSampler(list(range(1, 41)), tokensPerBatch=40, seed=1)
+    first, second = list(sampler), list(sampler)
+    assert sorted(first) == sorted(second)
+    assert first != second
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+
+def testAccumulationSteps():
+    sampler = TokenBudgetBatchSampler([10] * 40, tokensPerBatch=80)
+    assert len(sampler) == 5
+    assert sampler.accumulationSteps(32) == 4
+    assert sampler.accumulationSteps(2) == 1
+
+def testShardedBetweenProcesses():
+    lengths = [10] * 5
+    shards = [TokenBudgetBatchSampler(lengths, 10, seed=3, rank=rank, processes=2) for rank in range(2)]
+    assert [len(s) for s in shards] == [3, 3]
+
+    batches = [list(s) for s in shards]
+    assert batches[0] != batches[1]
+    seen = [b[0] for shard in batches for b in shard]
+    assert sorted(set(seen)) == [0, 1, 2, 3, 4]
+    assert len(seen) == 6
+
+def testBatchesRedrawnPerEpoch():
+    lengths = [10, 11, 12, 13, 14, 15, 16] * 4
+    sampler = TokenBudgetBatchSampler(lengths, tokensPerBatch=64, seed=1, lengthMultiple=8)
+    first, second = list(sampler), list(sampler)
+    assert sorted(len(b) for b in first) == sorted(len(b) for b in second)
+    assert len(first) == len(second) == len(sampler)
+    assert sorted(map(sorted, first)) != sorted(map(sorted, second))
+    for batch in first + second:
+        assert len(batch) * 16 <= 64
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+
+def testRedrawnBatchesShardedEvenly():
+    lengths = [9, 10, 11, 12, 13] * 5
+    shards = [TokenBudgetBatchSampler(lengths, 32, seed=3, rank=rank, processes=2, lengthMultiple=8) for rank in range(2)]
+    for _ in range(3):
+        batches = [list(s) for s in shards]
+        assert len(batches[0]) == len(batches[1]) == len(shards[0])
+        assert {i for shard in batches for b in shard for i in b} == set(range(len(lengths)))
@@ -0,0 +1,21 @@
+import math
+import pytest
+import torch
+
+from modules.scoring import sequenceLogLikelihoods, perplexity, ignoreIndex
+
+
+def testSequenceLogLikelihoods():
+    torch.manual_seed(0)
+    logits = torch.randn(2, 4, 5)
+    labels = torch.tensor([[1, 2, 3, 4], [ignoreIndex, ignoreIndex, 0, ignoreIndex]])
+
+    logLikelihoods, counts = sequenceLogLikelihoods(logits, labels)
+    logProbs = logits.log_softmax(dim=-1)
+    assert logLikelihoods[0].item() == pytest.approx(sum(logProbs[0, i, labels[0, i + 1]].item() for i in range(3)), abs=1e-5)
+    assert logLikelihoods[1].item() == pytest.approx(logProbs[1, 1, 0].item(), abs=1e-5)
+    assert counts.tolist() == [3, 1]
+
+def testPerplexity():
+    assert perplexity(-2 * math.log(4), 2) == pytest.approx(4)
+    assert math.isnan(perplexity(0.0, 0))
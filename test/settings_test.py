@@ -27,9 +27,17 @@ def testFallbackOutputPath():
 def testSectionDefaults():
     settings = Settings('test/resources/settings-min.json')
     assert settings.base.bits == 8
+    assert settings.base.device is None
+    assert settings.base.dtype is None
     assert settings.adapter.loraR == 16
     assert settings.training.cutoff == 256
+    assert settings.training.autoTune is False
+    assert settings.training.gradientCheckpointing is False
     assert settings.inference.maxLength == 1024
+    assert settings.inference.adapters is None
+    assert settings.inference.responseCacheEntries == 0
+    assert settings.distributed.processes == 1
+    assert settings.distributed.backend == "gloo"
     assert settings.ui.title == ""
 
 def testSectionParsing():
@@ -38,4 +46,5 @@ def testSectionParsing():
     assert settings.adapter.loraR == 8
     assert settings.training.cutoff == 512
     assert settings.inference.maxLength == 512
+    assert settings.inference.adapters == { "other" : "other-adapter" }
     assert settings.ui.title == "Test"
\ No newline at end of file
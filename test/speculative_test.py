@@ -0,0 +1,80 @@
+import pytest
+import torch
+
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from modules.engine import GenerationEngine, GenerationRequest
+from modules.speculative import SpeculativeEngine
+
+
+# Small randomly initialized models, no download needed.
+def makeModel(seed):
+    torch.manual_seed(seed)
+    config = GPT2Config(vocab_size=64, n_positions=128, n_embd=32, n_layer=2, n_head=2)
+    return GPT2LMHeadModel(config).eval()
+
+
+class ListStreamer:
+    def __init__(self):
+        self.tokens = []
+
+    def put(self, token):
+        self.tokens.extend(token.tolist())
+
+    def end(self):
+        pass
+
+
+def run(engine, prompt, **kwargs):
+    request = GenerationRequest(torch.tensor([prompt]), ListStreamer(), **kwargs)
+    engine.submit(request)
+    request.wait()
+    return request.streamer.tokens
+
+
+@pytest.fixture(scope="module")
+def target():
+    return makeModel(0)
+
+
+def testGreedyMatchesPlainDecoding(target):
+    plain = GenerationEngine(target, eosTokenId=-1)
+    speculative = SpeculativeEngine(target, makeModel(1), eosTokenId=-1, draftTokens=3)
+    for prompt in ([1, 2, 3], [5, 6, 7, 8, 9, 10]):
+        expected = run(plain, prompt, limit=20, temp=0)
+        assert run(speculative, prompt, limit=20, temp=0) == expected
+        assert len(expected) == 20
+    assert 0 <= speculative.acceptanceRate <= 1
+
+def testIdenticalDraftIsAlwaysAccepted(target):
+    speculative = SpeculativeEngine(target, target, eosTokenId=-1, draftTokens=4)
+    run(speculative, [1, 2, 3], limit=11, temp=0)
+    assert speculative.proposed == 8
+    assert speculative.acceptanceRate == 1
+
+def testSamplingRespectsLimit(target):
+    speculative = SpeculativeEngine(target, makeModel(1), eosTokenId=-1, draftTokens=4)
+    tokens = run(speculative, [1, 2, 3], limit=15, temp=0.8, top_p=0.9, top_k=20)
+    assert len(tokens) == 15
+    assert all(0 <= t < 64 for t in tokens)
+
+def testStopsAtEOS(target):
+    plain = GenerationEngine(target, eosTokenId=-1)
+    expected = run(plain, [1, 2, 3], limit=20, temp=0)
+    eos = expected[5]
+    speculative = SpeculativeEngine(target, makeModel(1), eosTokenId=eos, draftTokens=4)
+    tokens = run(speculative, [1, 2, 3], limit=20, temp=0)
+    assert tokens == expected[:expected.index(eos) + 1]
+
+def testErrorIsReported(target):
+    speculative = SpeculativeEngine(target, makeModel(1), eosTokenId=-1)
+    with pytest.raises(Exception):
+        run(speculative, [1000], limit=5, temp=0)
+    assert run(speculative, [1, 2], limit=3, temp=0)
+
+def testCloseEndsWorker(target):
+    engine = SpeculativeEngine(target, target, eosTokenId=-1)
+    assert len(run(engine, [1, 2, 3], limit=5, temp=0)) == 5
+    engine.close()
+    engine.thread.join(timeout=10)
+    assert not engine.thread.is_alive()
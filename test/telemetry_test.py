@@ -0,0 +1,76 @@
+import os
+import json
+import torch
+from types import SimpleNamespace
+
+from modules.telemetry import TrainingTelemetry, telemetryFileName
+
+
+def batch(lengths, width):
+    mask = torch.tensor([[1] * n + [0] * (width - n) for n in lengths])
+    return { "input_ids" : torch.zeros_like(mask), "attention_mask" : mask }
+
+
+def testStepRecords(tmp_path, capsys):
+    telemetry = TrainingTelemetry(str(tmp_path))
+    state = SimpleNamespace(global_step=0, is_world_process_zero=True)
+    telemetry.on_train_begin(None, state, None)
+
+    for step in (1, 2):
+        telemetry.batchStart(batch([3, 4], 4))
+        telemetry.batchEnd()
+        telemetry.batchStart(batch([2], 4))
+        telemetry.batchEnd()
+        state.global_step = step
+        telemetry.on_step_end(None, state, None)
+    telemetry.on_save(None, state, None)
+    telemetry.on_train_end(None, state, None)
+
+    with open(os.path.join(tmp_path, telemetryFileName)) as file:
+        records = [json.loads(line) for line in file]
+    assert [r["step"] for r in records] == [1, 2, 2]
+    assert records[0]["tokens"] == 9
+    assert records[0]["paddedTokens"] == 12
+    assert records[0]["paddingRatio"] == 0.25
+    assert records[1]["time"] >= records[1]["compute"]
+    assert records[1]["peakMemory"] > 0
+    assert "checkpointSaveTime" in records[2]
+    assert "Padding ratio: 25.0%" in capsys.readouterr().out
+
+def testAppendsOnResume(tmp_path):
+    state = SimpleNamespace(global_step=1, is_world_process_zero=True)
+    for _ in range(2):
+        telemetry = TrainingTelemetry(str(tmp_path))
+        telemetry.on_train_begin(None, state, None)
+        telemetry.batchStart(batch([1], 2))
+        telemetry.batchEnd()
+        telemetry.on_step_end(None, state, None)
+        telemetry.on_train_end(None, state, None)
+
+    with open(os.path.join(tmp_path, telemetryFileName)) as file:
+        assert len(file.readlines()) == 2
+
+def testOnlyMainProcessWrites(tmp_path):
+    telemetry = TrainingTelemetry(str(tmp_path))
+    state = SimpleNamespace(global_step=1, is_world_process_zero=False)
+    telemetry.on_train_begin(None, state, None)
+    telemetry.on_step_end(None, state, None)
+    telemetry.on_train_end(None, state, None)
+    assert not os.path.exists(os.path.join(tmp_path, telemetryFileName))
+
+def testTuningRecorded(tmp_path):
+    telemetry = TrainingTelemetry(str(tmp_path), tuning={ "batchSize" : 8 })
+    state = SimpleNamespace(global_step=0, is_world_process_zero=True)
+    telemetry.on_train_begin(None, state, None)
+    telemetry.on_train_end(None, state, None)
+
+    with open(os.path.join(tmp_path, telemetryFileName)) as file:
+        assert json.loads(file.readline()) == { "autoTune" : { "batchSize" : 8 } }
+
+def testPackedBlockTokens(tmp_path):
+    telemetry = TrainingTelemetry(str(tmp_path))
+    telemetry.on_train_begin(None, SimpleNamespace(global_step=0, is_world_process_zero=False), None)
+    positions = torch.tensor([[0, 1, 2, 0, 1, 0, 0, 0], [0, 1, 2, 3, 4, 5, 6, 7]])
+    telemetry.batchStart({ "input_ids" : torch.zeros_like(positions), "position_ids" : positions })
+    assert telemetry.tokens == 13
+    assert telemetry.paddedTokens == 16
@@ -36,3 +36,31 @@ def testApplyTemplateInvalidKey():
     with pytest.raises(KeyError) as excinfo:
         template.apply(instruction="do it")
     assert str(excinfo.value) == "'instruction'"
+
+
+def testApplyBatchNoTemplate():
+    template = Template()
+    assert template.applyBatch({ "input" : ["abc", "x"], "output" : ["def", ""] }) == ["abcdef", "x"]
+
+def testApplyBatchMixed():
+    template = Template("test/resources/data.template")
+    batch = {
+        "input" : ["do it", "do more", "do less"],
+        "add" : [None, "abc", ""],
+        "output" : ["ok", "fine", ""]
+    }
+    assert template.applyBatch(batch) == ["in:do it\nout:ok", "in:do more\nadd:abc\nout:fine", "in:do less\nout:"]
+
+def testApplyBatchMatchesApply():
+    template = Template("test/resources/data.template")
+    batch = { "input" : ["a{b}", "c"], "add" : ["}", None], "output" : ["1", "2"] }
+    rows = [dict(zip(batch, values)) for values in zip(*batch.values())]
+    assert template.applyBatch(batch) == [template.apply(**row) for row in rows]
+
+def testApplyBatchEmpty():
+    assert Template("test/resources/data.template").applyBatch({}) == []
+
+def testApplyBatchInvalidKey():
+    template = Template("test/resources/data.template")
+    with pytest.raises(KeyError):
+        template.applyBatch({ "instruction" : ["do it"] })